@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Analysis cache
+#
+# Search results keyed by the zobrist key of the searched position, so the
+# same position reached with different move counters (or by another game)
+# still hits. Each key keeps the deepest result seen, which answers any
+# request for that depth or less. Time-limited requests are answered by a
+# result whose search had at least as much time.
+#
+# Entries are dropped least recently used first beyond max_entries and
+# expire ttl_s seconds after they were stored. With a path, entries are
+# also written to an SQLite file and read back from it on a memory miss,
+# so the cache survives restarts.
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_S = 24 * 3600
+
+
+class CacheEntry:
+    __slots__ = ("move", "depth", "budget_ms", "stored")
+
+    def __init__(self, move, depth, budget_ms, stored):
+        self.move = move            # uci string
+        self.depth = depth          # completed search depth
+        self.budget_ms = budget_ms  # time the search had, None if depth limited
+        self.stored = stored        # time.time() when stored
+
+    def answers(self, depth=None, budget_ms=None):
+        if depth is not None:
+            return self.depth >= depth
+        return self.budget_ms is not None and budget_ms is not None and self.budget_ms >= budget_ms
+
+
+def _signed(key):
+    # sqlite integers are signed 64 bit
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class AnalysisCache:
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_s=DEFAULT_TTL_S, path=None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS analysis ("
+                            "key INTEGER PRIMARY KEY, move TEXT, depth INTEGER, budget_ms REAL, stored REAL)")
+            self.db.execute("DELETE FROM analysis WHERE stored < ?", (time.time() - ttl_s,))
+            self.db.commit()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _load(self, key):
+        if self.db is None:
+            return None
+        row = self.db.execute("SELECT move, depth, budget_ms, stored FROM analysis WHERE key = ?",
+                              (_signed(key),)).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def get(self, key, depth=None, budget_ms=None):
+        # cached uci move good enough for a search to depth, or with
+        # budget_ms when depth is None, else None
+        with self._lock:
+            entry = self.entries.pop(key, None) or self._load(key)
+            if entry is not None and time.time() - entry.stored > self.ttl_s:
+                entry = None
+            if entry is not None:
+                self.entries[key] = entry
+                self._trim()
+                if entry.answers(depth, budget_ms):
+                    self.hits += 1
+                    return entry.move
+            self.misses += 1
+            return None
+
+    def put(self, key, move, depth, budget_ms=None):
+        # Record a search result. The deeper of the new and the cached
+        # result is kept, with the larger of the two time budgets.
+        with self._lock:
+            now = time.time()
+            entry = self.entries.pop(key, None) or self._load(key)
+            if entry is not None and now - entry.stored <= self.ttl_s:
+                if budget_ms is None or (entry.budget_ms is not None and entry.budget_ms > budget_ms):
+                    budget_ms = entry.budget_ms
+                if entry.depth > depth:
+                    move, depth = entry.move, entry.depth
+            entry = CacheEntry(move, depth, budget_ms, now)
+            self.entries[key] = entry
+            self._trim()
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?)",
+                                (_signed(key), move, depth, budget_ms, now))
+                self.db.commit()
+
+    def _trim(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,145 @@
+import argparse
+import collections
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import chess
+import chess.pgn
+
+from search_stats import json_score
+
+# Batch analysis
+#
+# Positions are read lazily from EPD/FEN lines or PGN games, searched in a
+# pool of processes and yielded back in input order. Only a fixed window
+# of positions (a few per process) is in flight at any time, so memory
+# does not grow with the input.
+
+DEFAULT_DEPTH = 3
+# keep pygame's import banner off stdout in the worker processes
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+IN_FLIGHT_PER_WORKER = 4
+
+
+def read_epd(lines):
+    # (id, fen) for each EPD or FEN line, blank lines and # comments skipped
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = line.split()
+        try:
+            if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+                yield str(number), chess.Board(" ".join(fields[:6])).fen()
+            else:
+                board, ops = chess.Board.from_epd(line)
+                yield str(ops.get("id", number)), board.fen()
+        except ValueError:
+            # passed on as is, analyze() reports it
+            yield str(number), line
+
+
+def read_pgn(handle):
+    # (id, fen) for every position along each game's main line, the id is
+    # "<game number>:<ply>"
+    number = 0
+    while True:
+        game = chess.pgn.read_game(handle)
+        if game is None:
+            break
+        number += 1
+        board = game.board()
+        yield f"{number}:0", board.fen()
+        for ply, move in enumerate(game.mainline_moves(), start=1):
+            board.push(move)
+            yield f"{number}:{ply}", board.fen()
+
+
+def read_positions(handle, fmt="epd"):
+    return read_pgn(handle) if fmt == "pgn" else read_epd(handle)
+
+
+def analyze(position, depth=DEFAULT_DEPTH, movetime_ms=None):
+    # search one (id, fen) in this process, returns the result record
+    import chess_bot
+    chess_bot.VERBOSE = False   # stdout may be the JSON lines output
+    position_id, fen = position
+    result = {'id': position_id, 'fen': fen}
+    try:
+        board = chess.Board(fen)
+    except ValueError as e:
+        return dict(result, error=str(e))
+    if board.is_game_over():
+        return dict(result, move=None, score=None, depth=0, nodes=0, time_ms=0)
+    start = time.perf_counter()
+    move = chess_bot.get_best_move(board, depth, use_book=False, movetime_ms=movetime_ms)
+    return dict(result, move=move.uci(), score=json_score(chess_bot.last_score), depth=chess_bot.completed_depth,
+                nodes=chess_bot.node_count, time_ms=round((time.perf_counter() - start) * 1000, 1))
+
+
+class BatchPool:
+    # long-lived analysis processes
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = mp.get_context("spawn").Pool(self.workers)
+
+    def analyze(self, positions, depth=DEFAULT_DEPTH, movetime_ms=None):
+        # result records for positions, in input order
+        window = collections.deque()
+        positions = iter(positions)
+        limit = self.workers * IN_FLIGHT_PER_WORKER
+        while True:
+            while len(window) < limit:
+                position = next(positions, None)
+                if position is None:
+                    break
+                window.append(self.pool.apply_async(analyze, (position, depth, movetime_ms)))
+            if not window:
+                return
+            yield window.popleft().get()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="analyze EPD/FEN or PGN positions, one JSON line per position")
+    parser.add_argument("path", help="input file, - for stdin")
+    parser.add_argument("--format", choices=("epd", "pgn"), help="default: from the file extension")
+    parser.add_argument("--depth", type=int, help=f"search depth (default {DEFAULT_DEPTH} without --movetime)")
+    parser.add_argument("--movetime", type=int, help="ms per position")
+    parser.add_argument("--workers", type=int, help="processes (default: all cores)")
+    parser.add_argument("-o", "--output", help="output file (default stdout)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("pgn" if args.path.endswith(".pgn") else "epd")
+    depth = args.depth if args.depth or args.movetime else DEFAULT_DEPTH
+    handle = sys.stdin if args.path == "-" else open(args.path)
+    out = open(args.output, "w") if args.output else sys.stdout
+    pool = BatchPool(args.workers)
+    count = 0
+    start = time.perf_counter()
+    try:
+        for result in pool.analyze(read_positions(handle, fmt), depth, args.movetime):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            count += 1
+    finally:
+        pool.close()
+        if handle is not sys.stdin:
+            handle.close()
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(f"{count} positions in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.2f}/s) "
+          f"with {pool.workers} workers", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
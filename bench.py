@@ -0,0 +1,863 @@
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+
+import chess
+
+import bitbase
+import chess_bot
+import evaluation
+import game_session
+import opening_book
+import search_stats
+import smp
+import transposition
+import zobrist_hash
+import zobrist_hash_numpy
+
+# fixed position set shared by the checks and benchmarks below
+POSITIONS = [
+    chess.STARTING_FEN,
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "2r3k1/pp3ppp/4p3/3pP3/1P1P4/P4N2/5PPP/2R3K1 b - - 0 24",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "8/8/4k3/8/2P5/8/4K3/8 w - - 0 60",
+    "6k1/5ppp/8/8/8/8/5PPP/3Q2K1 w - - 0 40",
+    "r1b1k2r/ppppnppp/2n2q2/2b5/3NP3/2P1B3/PP3PPP/RN1QKB1R w KQkq - 1 7",
+]
+
+
+def random_walk(fen, plies, rng):
+    # boards reached by random legal moves from fen, including fen itself
+    board = chess.Board(fen)
+    boards = [board.copy()]
+    for _ in range(plies):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        board.push(rng.choice(moves))
+        boards.append(board.copy())
+    return boards
+
+
+def check_eval(args):
+    # differential check: bitboard evaluator (incremental and from scratch)
+    # against the array evaluator
+    rng = random.Random(args.seed)
+    checked = 0
+    for fen in POSITIONS:
+        for _ in range(args.games):
+            board = chess.Board(fen)
+            terms = evaluation.material_terms(board)
+            for _ in range(args.plies):
+                expected = chess_bot.evaluate_board_array(board)
+                for got in (evaluation.evaluate_board(board, terms), evaluation.evaluate_board(board)):
+                    if got != expected:
+                        print(f"mismatch {board.fen()}: {got!r} != {expected!r}")
+                        return 1
+                got = evaluation.evaluate_cp(board, terms)
+                if got != round(expected * evaluation.CP_PER_PAWN):
+                    print(f"centipawn mismatch {board.fen()}: {got} != {expected!r} pawns")
+                    return 1
+                if terms != evaluation.material_terms(board):
+                    print(f"incremental terms {terms} != {evaluation.material_terms(board)} in {board.fen()}")
+                    return 1
+                checked += 1
+                moves = list(board.legal_moves)
+                if not moves:
+                    break
+                move = rng.choice(moves)
+                terms = evaluation.update_terms(terms, board, move)
+                board.push(move)
+    print(f"eval: {checked} positions and incremental terms match")
+    return 0
+
+
+def bench_eval(args):
+    rng = random.Random(args.seed)
+    boards = [b for fen in POSITIONS for b in random_walk(fen, 40, rng)]
+    terms = [evaluation.material_terms(b) for b in boards]
+
+    results = {}
+    for name, fn in (("array", lambda b, t: chess_bot.evaluate_board_array(b)),
+                     ("bitboard", evaluation.evaluate_board)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for board, t in zip(boards, terms):
+                fn(board, t)
+        elapsed = time.perf_counter() - start
+        results[name] = len(boards) * args.repeat / elapsed
+        print(f"{name:>10}: {results[name]:12.0f} evals/s")
+    print(f"{'speedup':>10}: {results['bitboard'] / results['array']:12.1f}x")
+
+    # the tree is identical with either evaluator, so the wall-clock ratio
+    # at fixed depth is the nodes/s ratio
+    timings = {}
+    chess_bot.USE_EVAL_CACHE = False
+    for name, fn in (("array", lambda b, t=None: round(chess_bot.evaluate_board_array(b) * evaluation.CP_PER_PAWN)),
+                     ("bitboard", evaluation.evaluate_cp)):
+        chess_bot.evaluate_cp = fn
+        start = time.perf_counter()
+        for fen in POSITIONS:
+            chess_bot.get_best_move(chess.Board(fen), args.depth, use_book=False)
+        timings[name] = time.perf_counter() - start
+        print(f"{name:>10}: search depth {args.depth} in {timings[name]:.2f}s")
+    chess_bot.evaluate_cp = evaluation.evaluate_cp
+    chess_bot.USE_EVAL_CACHE = True
+    print(f"{'speedup':>10}: {timings['array'] / timings['bitboard']:12.1f}x")
+    return 0
+
+
+def check_zobrist(args):
+    checked = zobrist_hash.self_check(args.games, args.plies, args.seed)
+    print(f"zobrist: {checked} incremental hashes match")
+    return 0
+
+
+def random_endgame(piece_type, rng):
+    # a legal position of two kings and a piece_type of either color
+    while True:
+        board = chess.Board(None)
+        strong = rng.choice(chess.COLORS)
+        king, other_king, piece = rng.sample(chess.SQUARES, 3)
+        board.set_piece_at(king, chess.Piece(chess.KING, strong))
+        board.set_piece_at(other_king, chess.Piece(chess.KING, not strong))
+        board.set_piece_at(piece, chess.Piece(piece_type, strong))
+        board.turn = rng.choice(chess.COLORS)
+        if board.is_valid():
+            return board
+
+
+def mate_within(board, plies, winner):
+    # brute force: can winner force mate in at most plies
+    if board.is_checkmate():
+        return board.turn != winner
+    if plies == 0 or board.is_game_over():
+        return False
+    # the winner needs one mating line, the loser one escape
+    for move in board.legal_moves:
+        board.push(move)
+        result = mate_within(board, plies - 1, winner)
+        board.pop()
+        if result == (board.turn == winner):
+            return result
+    return board.turn != winner
+
+
+def check_bitbase(args):
+    # Sampled positions of each table against python-chess move generation:
+    # every probe must follow from the probes of its children (a capture or
+    # minor piece promotion is a draw), and short mates and draws must agree
+    # with a brute-force mate search of --plies.
+    tables = bitbase.Bitbases.open(args.path)
+    if tables is None:
+        print(f"no bitbases in {args.path}, build them with `python bitbase.py`")
+        return 1
+    rng = random.Random(args.seed)
+    for name, piece_type in bitbase.TABLES:
+        brute = 0
+        for _ in range(args.samples):
+            board = random_endgame(piece_type, rng)
+            result, plies = tables.probe(board)
+            if board.is_checkmate():
+                expected = (-1 if board.turn == chess.WHITE else 1, 0)
+            else:
+                children = []
+                for move in board.legal_moves:
+                    board.push(move)
+                    children.append(tables.probe(board) or (0, 0))
+                    board.pop()
+                side = 1 if board.turn == chess.WHITE else -1
+                wins = [p for r, p in children if r == side]
+                losses = [p for r, p in children if r == -side]
+                if wins:
+                    expected = (side, 1 + min(wins))
+                elif children and len(losses) == len(children):
+                    expected = (-side, 1 + max(losses))
+                else:
+                    expected = (0, 0)
+            if (result, plies) != expected:
+                print(f"{name} mismatch {board.fen()}: probe {(result, plies)} != {expected} from the children")
+                return 1
+            if plies <= args.plies:
+                winner = chess.WHITE if result >= 0 else chess.BLACK
+                if result and not (mate_within(board, plies, winner)
+                                   and (plies < 2 or not mate_within(board, plies - 2, winner))):
+                    print(f"{name} brute force disagrees on {board.fen()}: mate in {plies} plies")
+                    return 1
+                if not result and any(mate_within(board, args.plies, color) for color in chess.COLORS):
+                    print(f"{name} brute force finds a mate in {board.fen()}, probed as a draw")
+                    return 1
+                brute += 1
+        print(f"{name}: {args.samples} positions consistent, {brute} also checked by brute force")
+    return 0
+
+
+def bench_convert(args):
+    # Plays won KPK / KRK / KQK positions out, engine against engine at
+    # --depth, with the bitbases and (as A) without. Counts the games the
+    # winning side mates within --max-plies.
+    chess_bot.VERBOSE = False
+    for name, piece_type in bitbase.TABLES:
+        rng = random.Random(args.seed)
+        starts = []
+        while len(starts) < args.games:
+            board = random_endgame(piece_type, rng)
+            result, _ = chess_bot.BITBASES.probe(board)
+            if result and not board.is_game_over():
+                starts.append(board)
+        for label, enabled in (("off", False), ("on", True)):
+            chess_bot.USE_BITBASES = enabled
+            mated, plies = 0, 0
+            start = time.perf_counter()
+            for board in starts:
+                board = board.copy()
+                chess_bot.shared_tt.clear()
+                chess_bot.shared_ordering.clear()
+                while not board.is_game_over(claim_draw=True) and len(board.move_stack) < args.max_plies:
+                    board.push(chess_bot.get_best_move(board, args.depth, use_book=False))
+                if board.is_checkmate():
+                    mated += 1
+                    plies += len(board.move_stack)
+            chess_bot.USE_BITBASES = True
+            print(f"{name} bitbases {label:>3}: mated {mated}/{len(starts)}, "
+                  f"{plies / max(mated, 1):.1f} plies per mate, {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+def bench_zobrist(args):
+    rng = random.Random(args.seed)
+    boards = [b for fen in POSITIONS for b in random_walk(fen, 40, rng)]
+    samples = [(b, m) for b in boards for m in b.legal_moves]
+
+    results = {}
+    for name, module in (("numpy", zobrist_hash_numpy), ("int", zobrist_hash)):
+        hashes = {id(b): module.get_board_hash(b) for b in boards}
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for b in boards:
+                module.get_board_hash(b)
+        full = len(boards) * args.repeat / (time.perf_counter() - start)
+
+        # every legal move of every board, hashed incrementally
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for b, m in samples:
+                module.process_move(hashes[id(b)], b, m)
+        incremental = len(samples) * args.repeat / (time.perf_counter() - start)
+        results[name] = (full, incremental)
+        print(f"{name:>10}: {full:10.0f} full hashes/s {incremental:10.0f} incremental hashes/s")
+    print(f"{'speedup':>10}: {results['int'][0] / results['numpy'][0]:10.1f}x"
+          f"{'':17}{results['int'][1] / results['numpy'][1]:10.1f}x")
+    return 0
+
+
+class DictTable:
+    # the old seen_states layout (one dict per node) behind the
+    # TranspositionTable interface, for comparison only
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.states = {}
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self, generation=None):
+        self.clear()
+
+    def __len__(self):
+        return len(self.states)
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.states.get(key)
+        if entry is None:
+            return None
+        self.hits += 1
+        return entry["score"], entry["depth"], entry["flag"], entry["move"]
+
+    def get_move(self, key):
+        return self.states.get(key, {}).get("move")
+
+    def store(self, key, score, depth, flag, move):
+        self.states[key] = {"score": score, "depth": depth, "flag": flag, "move": move}
+
+    @property
+    def memory_bytes(self):
+        # outer dict, keys and one dict + float per entry (small ints and
+        # moves are shared with the search)
+        total = sys.getsizeof(self.states)
+        for key, entry in self.states.items():
+            total += sys.getsizeof(key) + sys.getsizeof(entry) + sys.getsizeof(entry["score"])
+        return total
+
+
+def bench_tt(args):
+    tables = (("dict", DictTable), (f"array {args.tt_mb}MB", lambda: transposition.TranspositionTable(args.tt_mb)))
+    for name, factory in tables:
+        table = factory()
+        chess_bot.shared_tt = table
+        probes = hits = entries = peak = 0
+        moves = []
+        start = time.perf_counter()
+        for fen in POSITIONS:
+            table.clear()
+            moves.append(chess_bot.get_best_move(chess.Board(fen), args.depth, use_book=False))
+            probes += table.probes
+            hits += table.hits
+            entries = max(entries, len(table))
+            peak = max(peak, table.memory_bytes)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>12}: {peak / 2**20:7.2f} MB, max {entries:7d} entries, "
+              f"hit rate {hits / max(probes, 1):6.1%}, {elapsed:6.2f}s")
+        print(f"{'':>12}  moves {' '.join(m.uci() for m in moves)}")
+    return 0
+
+
+# Morphy - Duke Karl / Count Isouard, Paris 1858
+REPLAY_GAME = ("e2e4 e7e5 g1f3 d7d6 d2d4 c8g4 d4e5 g4f3 d1f3 d6e5 f1c4 g8f6 f3b3 d8e7 "
+               "b1c3 c7c6 c1g5 b7b5 c3b5 c6b5 c4b5 b8d7 e1c1 a8d8 d1d7 d8d7 h1d1 e7e6 "
+               "b5d7 f6d7 b3b8 d7b8 d1d8").split()
+
+
+def bench_replay(args):
+    # time-to-depth over every position of a game, table cleared before each
+    # search (cold) versus kept between searches (warm)
+    board = chess.Board()
+    positions = []
+    for uci in REPLAY_GAME:
+        positions.append(board.copy())
+        board.push_uci(uci)
+    positions = [b for b in positions if b.legal_moves.count()][args.skip:]
+
+    totals = {}
+    for name, warm in (("cold", False), ("warm", True)):
+        chess_bot.configure_tables("game", args.tt_mb)
+        times = []
+        for board in positions:
+            if not warm:
+                chess_bot.game_tables.clear()
+            start = time.perf_counter()
+            chess_bot.get_best_move(board.copy(), args.depth, use_book=False, game_id="replay")
+            times.append(time.perf_counter() - start)
+        totals[name] = sum(times)
+        print(f"{name:>6}: {totals[name]:7.2f}s total, first {times[0]:.2f}s, "
+              f"later moves avg {sum(times[1:]) / max(len(times) - 1, 1):.2f}s")
+    chess_bot.configure_tables("shared")
+    print(f"{'gain':>6}: {totals['cold'] / totals['warm']:7.2f}x")
+    return 0
+
+
+def bench_sessions(args):
+    # --games games played side by side, a random human move and then an
+    # engine reply per game and turn, the way the server interleaves them.
+    # Each position is searched twice: from its FEN in the tables every game
+    # shares (/api/move) and as a game session, with the hash and history
+    # kept up to date and the game's own tables (/api/games). Each side has
+    # its own eval caches, the session's move is played. With --human-depth
+    # the human plays the engine's move at that depth (in tables of its
+    # own) after --random-moves random ones, which keep the games apart. With --ponder the session side ponders
+    # after each reply, untimed like the human's think time, and the bench
+    # counts how often the human then played the pondered move.
+    rng = random.Random(args.seed)
+    chess_bot.configure_tables("shared", args.tt_mb, 2 * args.games)
+    caches = {name: (chess_bot.ScoreCache(chess_bot.EVAL_CACHE_ENTRIES), chess_bot.ScoreCache(chess_bot.PAWN_TABLE_ENTRIES))
+              for name in ("fen", "session", "human")}
+    totals = {name: [0, 0.0] for name in ("fen", "session")}     # nodes, setup + search seconds
+    games = [game_session.GameSession(str(i)) for i in range(args.games)]
+    pondered = {}   # game_id -> reply the session pondered on
+    searched = hits = ponders = 0
+    ponder_s = 0.0
+    for turn in range(args.moves):
+        for game in games:
+            legal = list(game.board.legal_moves)
+            if not legal:
+                continue
+            if args.human_depth and turn >= args.random_moves:
+                chess_bot.eval_cache, chess_bot.pawn_table = caches["human"]
+                move = chess_bot.get_best_move(game.board, args.human_depth, use_book=False,
+                                               game_id="human-" + game.game_id, tt_mode="game")
+            else:
+                move = rng.choice(legal)
+            hits += move == pondered.pop(game.game_id, None)
+            game.push(move)
+            if game.board.is_game_over():
+                continue
+            for name in totals:
+                chess_bot.eval_cache, chess_bot.pawn_table = caches[name]
+                start = time.perf_counter()
+                if name == "fen":
+                    board = chess.Board(game.fen)
+                    move = chess_bot.get_best_move(board, args.depth, use_book=False, game_id=game.game_id)
+                else:
+                    move = chess_bot.get_best_move(game.board, args.depth, use_book=False, game_id=game.game_id,
+                                                   tt_mode="game", root_hash=game.hash, history=game.history)
+                totals[name][0] += chess_bot.node_count
+                totals[name][1] += time.perf_counter() - start
+            searched += 1
+            game.push(move)
+            if args.ponder and not game.board.is_game_over():
+                start = time.perf_counter()
+                reply = game.ponder(args.ponder)
+                ponder_s += time.perf_counter() - start
+                if reply is not None:
+                    pondered[game.game_id] = reply
+                    ponders += 1
+    chess_bot.eval_cache, chess_bot.pawn_table = caches["fen"]
+    chess_bot.configure_tables("shared", args.tt_mb)
+    for name, (nodes, seconds) in totals.items():
+        print(f"{name:>8}: {searched} moves, {nodes / searched:8.0f} nodes/move, {seconds / searched * 1000:7.1f} ms/move")
+    if args.ponder:
+        print(f"{'ponder':>8}: {hits}/{ponders} pondered replies played, "
+              f"{ponder_s / searched * 1000:7.1f} ms pondering/move")
+    print(f"{'speedup':>8}: {totals['fen'][1] / totals['session'][1]:8.2f}x time, "
+          f"{totals['fen'][0] / totals['session'][0]:.2f}x nodes")
+    return 0
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def bench_timed(args):
+    # response time of timed searches against their budget
+    for movetime in args.movetime:
+        times = []
+        for _ in range(args.repeat):
+            for fen in POSITIONS:
+                start = time.perf_counter()
+                chess_bot.get_best_move(chess.Board(fen), use_book=False, movetime_ms=movetime)
+                times.append((time.perf_counter() - start) * 1000)
+        over = sum(t > movetime for t in times)
+        print(f"movetime {movetime:6d}ms: p50 {percentile(times, 50):7.1f}ms  p99 {percentile(times, 99):7.1f}ms  "
+              f"max {max(times):7.1f}ms  over budget {over}/{len(times)}")
+    return 0
+
+
+def run_suite(depth=None, positions=POSITIONS, movetime_ms=None, workers=1):
+    # fresh search state per position so runs are comparable
+    moves, nodes, depths = [], 0, []
+    start = time.perf_counter()
+    for fen in positions:
+        chess_bot.shared_tt.clear()
+        if workers > 1:
+            smp.get_pool(workers, chess_bot.shared_tt.size_mb).table.clear()
+        chess_bot.shared_ordering.clear()
+        chess_bot.eval_cache.clear()
+        chess_bot.pawn_table.clear()
+        moves.append(chess_bot.get_best_move(chess.Board(fen), depth, use_book=False, movetime_ms=movetime_ms,
+                                             workers=workers))
+        nodes += chess_bot.node_count
+        depths.append(chess_bot.completed_depth)
+    return moves, nodes, time.perf_counter() - start, depths
+
+
+def bench_ab(args):
+    # search switches off (A) against on (B), at equal depth or, with
+    # --movetime, at equal time per position
+    results = {}
+    for name, enabled in (("off", False), ("on", True)):
+        saved = {flag: getattr(chess_bot, flag) for flag in args.flag}
+        for flag in args.flag:
+            setattr(chess_bot, flag, enabled)
+        try:
+            if args.movetime:
+                results[name] = run_suite(movetime_ms=args.movetime)
+            else:
+                results[name] = run_suite(args.depth)
+        finally:
+            for flag, value in saved.items():
+                setattr(chess_bot, flag, value)
+        moves, nodes, elapsed, depths = results[name]
+        print(f"{name:>4}: {nodes:9d} nodes {elapsed:7.2f}s  {' '.join(m.uci() for m in moves)}")
+        if args.movetime:
+            print(f"{'':>4}  depth reached {' '.join(map(str, depths))}, median {percentile(depths, 50)}")
+    same = sum(a == b for a, b in zip(results["off"][0], results["on"][0]))
+    print(f"{', '.join(args.flag)}: nodes {results['on'][1] / results['off'][1]:.2f}x, "
+          f"time {results['on'][2] / results['off'][2]:.2f}x, same move {same}/{len(POSITIONS)}")
+    return 0
+
+
+def bench_smp(args):
+    # Lazy SMP speedup curve: time to reach --depth on every position and
+    # nodes searched per second across all processes
+    base = None
+    for workers in args.workers:
+        # start the pool outside the timed region
+        if workers > 1:
+            smp.get_pool(workers, chess_bot.shared_tt.size_mb)
+        moves, nodes, elapsed, depths = run_suite(args.depth, workers=workers)
+        if base is None:
+            base = elapsed
+        print(f"{workers:3d} workers: {elapsed:7.2f}s  speedup {base / elapsed:5.2f}x  "
+              f"{nodes / elapsed:8.0f} nps  {' '.join(m.uci() for m in moves)}")
+    smp.close_pools()
+    return 0
+
+
+BENCH_EPD = "positions/bench.epd"
+TACTICS_EPD = "positions/tactics.epd"
+
+
+def load_bench_positions(path=BENCH_EPD):
+    # [(id, category, fen)] from an EPD file with id and c0 opcodes
+    positions = []
+    with open(path) as handle:
+        for line in handle:
+            if line.strip() and not line.startswith("#"):
+                board, ops = chess.Board.from_epd(line)
+                positions.append((ops.get("id", str(len(positions) + 1)), ops.get("c0", ""), board.fen()))
+    return positions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_search(args):
+    # Fixed-depth search of every bench position from a clean state. The
+    # total node count is the signature: it only changes when the search
+    # itself changes, not with machine speed.
+    chess_bot.VERBOSE = False
+    if args.profile:
+        chess_bot.enable_profiling()
+    results = []
+    for position_id, category, fen in load_bench_positions(args.positions):
+        chess_bot.shared_tt.clear()
+        chess_bot.shared_ordering.clear()
+        chess_bot.eval_cache.clear()
+        chess_bot.pawn_table.clear()
+        start = time.perf_counter()
+        move, stats = chess_bot.get_best_move(chess.Board(fen), args.depth, use_book=False, stats=True)
+        elapsed = time.perf_counter() - start
+        table = chess_bot.tt
+        results.append({
+            "id": position_id, "category": category, "fen": fen, "move": move.uci(),
+            "nodes": chess_bot.node_count, "qnodes": chess_bot.qnode_count, "time_s": elapsed,
+            "nps": chess_bot.node_count / elapsed,
+            "tt_hit_rate": table.hits / table.probes if table.probes else 0.0,
+            "eval_hit_rate": stats.eval_hit_rate, "pawn_hit_rate": stats.pawn_hit_rate,
+            "profile": stats.profile,
+            # seconds and nodes at the end of each iteration, i.e. time to depth
+            "iterations": [{"depth": d, "time_s": t, "nodes": n} for d, t, n, *_ in chess_bot.iterations],
+        })
+        if not args.quiet:
+            r = results[-1]
+            print(f"{position_id:<26} {r['move']:<6} {r['nodes']:9d} nodes {r['qnodes'] / max(r['nodes'], 1):5.1%} q "
+                  f"{r['time_s']:7.2f}s {r['nps']:7.0f} nps  tt hits {r['tt_hit_rate']:5.1%}")
+
+    nodes = sum(r["nodes"] for r in results)
+    elapsed = sum(r["time_s"] for r in results)
+    summary = {
+        "revision": git_revision(), "depth": args.depth, "positions": len(results),
+        "signature": nodes, "nodes": nodes, "qnodes": sum(r["qnodes"] for r in results),
+        "time_s": elapsed, "nps": nodes / elapsed,
+        "tt_hit_rate": sum(r["tt_hit_rate"] for r in results) / len(results),
+        "eval_hit_rate": sum(r["eval_hit_rate"] for r in results) / len(results),
+        "pawn_hit_rate": sum(r["pawn_hit_rate"] for r in results) / len(results),
+    }
+    print(f"depth {args.depth}: {nodes} nodes ({summary['qnodes'] / nodes:.1%} quiescence) in {elapsed:.2f}s, "
+          f"{summary['nps']:.0f} nps, tt hit rate {summary['tt_hit_rate']:.1%}, "
+          f"eval cache {summary['eval_hit_rate']:.1%}, pawn table {summary['pawn_hit_rate']:.1%}")
+    if args.profile:
+        chess_bot.disable_profiling()
+        summary["profile"] = {part: sum(r["profile"][part] for r in results) for part in results[0]["profile"]}
+        print("profile: " + ", ".join(f"{part} {seconds:.2f}s" for part, seconds in summary["profile"].items()))
+    print(f"signature: {nodes}")
+
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(dict(summary, results=results), handle, indent=1)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            base = json.load(handle)
+        same = base["signature"] == nodes and base["depth"] == args.depth
+        print(f"vs {base.get('revision') or args.compare}: nodes {nodes / base['nodes']:.3f}x, "
+              f"time {elapsed / base['time_s']:.3f}x, nps {summary['nps'] / base['nps']:.3f}x, "
+              f"signature {'unchanged' if same else 'CHANGED'}")
+    return 0
+
+
+def bench_tactics(args):
+    # Solved positions and search effort on the tactical suite. --flag
+    # switches (e.g. USE_SEE_PRUNING) off for the run, to compare against.
+    chess_bot.VERBOSE = False
+    saved = {flag: getattr(chess_bot, flag) for flag in args.flag}
+    for flag in args.flag:
+        setattr(chess_bot, flag, False)
+    solved = nodes = qnodes = 0
+    elapsed = 0.0
+    try:
+        with open(args.positions) as handle:
+            lines = [line for line in handle if line.strip() and not line.startswith("#")]
+        for line in lines:
+            board, ops = chess.Board.from_epd(line)
+            chess_bot.shared_tt.clear()
+            chess_bot.shared_ordering.clear()
+            start = time.perf_counter()
+            move = chess_bot.get_best_move(board, args.depth, use_book=False, movetime_ms=args.movetime)
+            elapsed += time.perf_counter() - start
+            ok = move in ops["bm"]
+            solved += ok
+            nodes += chess_bot.node_count
+            qnodes += chess_bot.qnode_count
+            if not args.quiet:
+                print(f"{ops.get('id', ''):<10} {'ok  ' if ok else 'FAIL'} {board.san(move):<7} "
+                      f"(bm {' '.join(board.san(m) for m in ops['bm'])})  {chess_bot.node_count:8d} nodes "
+                      f"{chess_bot.qnode_count:8d} qnodes  depth {chess_bot.completed_depth}")
+    finally:
+        for flag, value in saved.items():
+            setattr(chess_bot, flag, value)
+    off = f" with {', '.join(args.flag)} off" if args.flag else ""
+    print(f"solved {solved}/{len(lines)}{off}: {nodes} nodes, {qnodes} quiescence, {elapsed:.2f}s")
+    return 0
+
+
+def bench_ponder(args):
+    # time to --depth after the expected move, with a cold table versus
+    # after pondering on that position for --ponder ms
+    totals = {"cold": 0.0, "pondered": 0.0}
+    for fen in POSITIONS:
+        board = chess.Board(fen)
+        for name in totals:
+            chess_bot.shared_tt.clear()
+            if name == "pondered":
+                chess_bot.get_best_move(board.copy(), use_book=False, movetime_ms=args.ponder)
+            start = time.perf_counter()
+            chess_bot.get_best_move(board.copy(), args.depth, use_book=False)
+            totals[name] += time.perf_counter() - start
+    print(f"depth {args.depth}: cold {totals['cold']:.2f}s, after {args.ponder}ms ponder {totals['pondered']:.2f}s "
+          f"({totals['cold'] / totals['pondered']:.1f}x)")
+    return 0
+
+
+def book_positions(book, games, plies, rng):
+    # boards along book lines, so most probes hit, plus a random walk each
+    boards = []
+    for _ in range(games):
+        board = chess.Board()
+        for _ in range(plies):
+            boards.append(board.copy())
+            move = book.weighted_choice(board, rng=rng)
+            if move is None:
+                break
+            board.push(move)
+        boards.extend(random_walk(board.fen(), 4, rng)[1:])
+    return boards
+
+
+def bench_multipv(args):
+    # One multipv search of --lines lines against the way hints were found
+    # before: --lines searches, each excluding the moves already found,
+    # sharing the table. Tables are cleared per position for both.
+    # Lines agree when both find the same moves with the same scores.
+    chess_bot.VERBOSE = False
+    totals = {name: [0, 0.0] for name in ("multipv", "searches")}     # nodes, seconds
+    same = count = 0
+    for position_id, _, fen in load_bench_positions(args.positions):
+        found = {}
+        for name in totals:
+            chess_bot.shared_tt.clear()
+            chess_bot.shared_ordering.clear()
+            chess_bot.eval_cache.clear()
+            chess_bot.pawn_table.clear()
+            board = chess.Board(fen)
+            start = time.perf_counter()
+            if name == "multipv":
+                chess_bot.search(board, args.depth, None, chess_bot.shared_tt, multipv=args.lines)
+                nodes = chess_bot.node_count
+                lines = [(pv[0], score) for score, pv in chess_bot.root_lines]
+            else:
+                nodes, lines = 0, []
+                moves = list(board.legal_moves)
+                while moves and len(lines) < args.lines:
+                    move = chess_bot.search(board, args.depth, None, chess_bot.shared_tt, root_moves=moves)
+                    nodes += chess_bot.node_count
+                    lines.append((move, chess_bot.last_score))
+                    moves.remove(move)
+            totals[name][0] += nodes
+            totals[name][1] += time.perf_counter() - start
+            found[name] = lines
+        count += len(found["multipv"])
+        same += len(set(found["multipv"]) & set(found["searches"]))
+        if not args.quiet:
+            print(f"{position_id:<26} " + "  ".join(f"{move.uci()} {search_stats.json_score(score)}"
+                                                   for move, score in found["multipv"]))
+    for name, (nodes, seconds) in totals.items():
+        print(f"{name:>9}: {nodes:9d} nodes {seconds:7.2f}s")
+    print(f"{args.lines} lines: nodes {totals['multipv'][0] / totals['searches'][0]:.2f}x, "
+          f"time {totals['multipv'][1] / totals['searches'][1]:.2f}x, same line {same}/{count}")
+    return 0
+
+
+def bench_book(args):
+    # probe throughput and agreement, python-chess reader vs in-memory book
+    import chess.polyglot
+    rng = random.Random(args.seed)
+    book = opening_book.Book.open(args.path, args.min_weight)
+    if args.merge:
+        book = opening_book.Book.merge([book] + [opening_book.Book.open(p) for p in args.merge], args.min_weight)
+    print(f"{len(book)} entries, {book.entries.nbytes / 1e6:.1f}MB")
+    if args.save:
+        book.save(args.save)
+        print(f"saved {args.save}")
+
+    boards = book_positions(book, args.games, 20, rng)
+    keys = [zobrist_hash.get_board_hash(b) for b in boards]
+    # the reader needs a polyglot file, a .npy is compared for speed only
+    polyglot = not args.path.endswith(".npy")
+    with chess.polyglot.open_reader(args.path if polyglot else chess_bot.BOOK_PATH) as reader:
+        if polyglot and not args.merge:
+            for board, key in zip(boards, keys):
+                expected = sorted((e.move.uci(), e.weight) for e in reader.find_all(board, minimum_weight=args.min_weight))
+                found = sorted((m.uci(), w) for m, w in book.moves(board, key))
+                assert expected == found, f"{board.fen()}: reader {expected} != book {found}"
+            print(f"{len(boards)} positions, {sum(bool(book.moves(b)) for b in boards)} in book, entries agree")
+
+        # key lookups alone, then lookups plus move decoding and legality
+        for name, probe in (("reader key", lambda board, key: list(reader.find_all(key))),
+                            ("numpy key", lambda board, key: book.find(key)),
+                            ("reader", lambda board, key: list(reader.find_all(board))),
+                            ("numpy", lambda board, key: book.moves(board, key))):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                for board, key in zip(boards, keys):
+                    probe(board, key)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>10}: {args.repeat * len(boards) / elapsed:9.0f} probes/s")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chesser engine checks and benchmarks")
+    parser.add_argument("--seed", type=int, default=718)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("check-eval", help="bitboard vs array evaluator differential check")
+    p.add_argument("--games", type=int, default=20)
+    p.add_argument("--plies", type=int, default=80)
+    p.set_defaults(func=check_eval)
+
+    p = sub.add_parser("eval", help="evaluator throughput, array vs bitboard")
+    p.add_argument("--repeat", type=int, default=20)
+    p.add_argument("--depth", type=int, default=3)
+    p.set_defaults(func=bench_eval)
+
+    p = sub.add_parser("check-zobrist", help="incremental vs from-scratch zobrist hashes over random games")
+    p.add_argument("--games", type=int, default=200)
+    p.add_argument("--plies", type=int, default=120)
+    p.set_defaults(func=check_zobrist)
+
+    p = sub.add_parser("check-bitbase", help="bitbase probes vs python-chess move generation and brute force")
+    p.add_argument("--path", default=bitbase.BITBASE_DIR)
+    p.add_argument("--samples", type=int, default=1000)
+    p.add_argument("--plies", type=int, default=5, help="brute-force depth for short mates and draws")
+    p.set_defaults(func=check_bitbase)
+
+    p = sub.add_parser("convert", help="play won bitbase endings out with and without the bitbases")
+    p.add_argument("--depth", type=int, default=3)
+    p.add_argument("--games", type=int, default=10)
+    p.add_argument("--max-plies", type=int, default=100)
+    p.set_defaults(func=bench_convert)
+
+    p = sub.add_parser("zobrist", help="hashes per second, numpy vs int implementation")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_zobrist)
+
+    p = sub.add_parser("tt", help="memory and hit rate, dict vs array transposition table")
+    p.add_argument("--depth", type=int, default=4)
+    p.add_argument("--tt-mb", type=int, default=transposition.TT_SIZE_MB)
+    p.set_defaults(func=bench_tt)
+
+    p = sub.add_parser("replay", help="time-to-depth replaying a game, cold vs persistent table")
+    p.add_argument("--depth", type=int, default=3)
+    p.add_argument("--skip", type=int, default=0, help="skip the first N plies")
+    p.add_argument("--tt-mb", type=int, default=transposition.TT_SIZE_MB)
+    p.set_defaults(func=bench_replay)
+
+    p = sub.add_parser("sessions", help="interleaved games searched from FENs in shared tables vs as game sessions")
+    p.add_argument("--games", type=int, default=4)
+    p.add_argument("--moves", type=int, default=20, help="engine moves per game")
+    p.add_argument("--depth", type=int, default=3)
+    p.add_argument("--seed", type=int, default=11)
+    p.add_argument("--tt-mb", type=int, default=transposition.TT_SIZE_MB)
+    p.add_argument("--ponder", type=int, default=0, metavar="MS", help="session pondering time per reply")
+    p.add_argument("--human-depth", type=int, default=0,
+                   help="the human plays the engine's move at this depth, 0 plays random moves")
+    p.add_argument("--random-moves", type=int, default=3, help="random human moves before --human-depth applies")
+    p.set_defaults(func=bench_sessions)
+
+    p = sub.add_parser("timed", help="response time percentiles of movetime-limited searches")
+    p.add_argument("--movetime", type=int, nargs="+", default=[100, 500, 2000])
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_timed)
+
+    p = sub.add_parser("ab", help="compare search switches (e.g. USE_PVS) off vs on at fixed depth")
+    p.add_argument("--depth", type=int, default=4)
+    p.add_argument("--movetime", type=int, help="search each position for this many ms instead of to --depth")
+    p.add_argument("--flag", action="append", required=True)
+    p.set_defaults(func=bench_ab)
+
+    p = sub.add_parser("smp", help="time to depth with 1..N lazy SMP worker processes")
+    p.add_argument("--depth", type=int, default=4)
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    p.set_defaults(func=bench_smp)
+
+    p = sub.add_parser("bench", help="fixed-depth search of the checked-in positions, node signature")
+    p.add_argument("--depth", type=int, default=3)
+    p.add_argument("--positions", default=BENCH_EPD)
+    p.add_argument("--json", help="write the results as JSON to this file")
+    p.add_argument("--compare", help="JSON from an earlier run to compare against")
+    p.add_argument("--quiet", action="store_true", help="summary only")
+    p.add_argument("--profile", action="store_true", help="time spent in eval, hashing, move generation and ordering")
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser("tactics", help="tactical suite: solved positions and quiescence nodes")
+    p.add_argument("--depth", type=int, default=4)
+    p.add_argument("--movetime", type=int, help="ms per position, deepening until then without --depth")
+    p.add_argument("--positions", default=TACTICS_EPD)
+    p.add_argument("--flag", action="append", default=[], help="search switch to turn off")
+    p.add_argument("--quiet", action="store_true", help="summary only")
+    p.set_defaults(func=bench_tactics)
+
+    p = sub.add_parser("ponder", help="time to depth with a cold table vs after pondering the position")
+    p.add_argument("--depth", type=int, default=4)
+    p.add_argument("--ponder", type=int, default=3000, help="ms spent pondering")
+    p.set_defaults(func=bench_ponder)
+
+    p = sub.add_parser("multipv", help="top N root moves from one multipv search vs N searches excluding moves")
+    p.add_argument("--depth", type=int, default=3)
+    p.add_argument("--lines", type=int, default=3)
+    p.add_argument("--positions", default=BENCH_EPD)
+    p.add_argument("--quiet", action="store_true", help="summary only")
+    p.set_defaults(func=bench_multipv)
+
+    p = sub.add_parser("book", help="opening book probes per second, polyglot reader vs numpy book")
+    p.add_argument("--path", default=chess_bot.BOOK_PATH)
+    p.add_argument("--merge", nargs="+", help="further books merged into --path")
+    p.add_argument("--min-weight", type=int, default=1)
+    p.add_argument("--save", help="write the (merged) book as .npy for memory mapping")
+    p.add_argument("--games", type=int, default=50)
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(func=bench_book)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import argparse
+import os
+import sys
+import time
+from array import array
+
+import numpy as np
+
+import chess
+
+# Endgame bitbases
+#
+# Exact results for king and one piece against a bare king (KPK, KRK, KQK),
+# built offline by retrograde analysis and stored in BITBASE_DIR. Each
+# table covers every placement of the three pieces with either side to
+# move, normalized so the side with the piece is white:
+#
+#   index = side to move (0 white, 1 black) << 18 | white king << 12
+#           | black king << 6 | piece square
+#
+# <name>.wdl.npy holds one bit per index (np.packbits order), set when
+# white wins. <name>.dtm.npy holds one byte per index, the distance to
+# mate in plies for won positions. The lone king never wins, everything
+# else is a draw. Both files are memory mapped, so engine processes share
+# one copy through the page cache.
+#
+# Generation: mates are known first, then level n of the retrograde pass
+# marks white-to-move positions with a move to a position mated in n - 1
+# plies (n odd), and black-to-move positions whose moves all reach known
+# wins (n even). KPK promotions lead into the KQK and KRK tables, which are
+# built first. Run `python bitbase.py` to rebuild the files.
+
+BITBASE_DIR = "bitbases"
+TABLES = (("kqk", chess.QUEEN), ("krk", chess.ROOK), ("kpk", chess.PAWN))
+SIZE = 1 << 19
+
+
+def index(stm, white_king, black_king, piece):
+    return stm << 18 | white_king << 12 | black_king << 6 | piece
+
+
+def _piece_attacks(piece_type, square, occupied):
+    if piece_type == chess.PAWN:
+        return chess.BB_PAWN_ATTACKS[chess.WHITE][square]
+    attacks = (chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied]
+               | chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied])
+    if piece_type == chess.QUEEN:
+        attacks |= chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied]
+    return attacks
+
+
+def _edges(piece_type):
+    # Move graph of one table: (white_src, white_dst, black_src, black_dst,
+    # mates). Destinations past SIZE point into the KQK (SIZE..) and KRK
+    # (2 * SIZE..) tables, 3 * SIZE is a draw (piece captured, minor piece
+    # promotion).
+    draw = 3 * SIZE
+    white_src, white_dst = array('i'), array('i')
+    black_src, black_dst = array('i'), array('i')
+    mates = array('i')
+    squares = range(64)
+    for wk in squares:
+        wk_bb = chess.BB_SQUARES[wk]
+        wk_attacks = chess.BB_KING_ATTACKS[wk]
+        for bk in squares:
+            bk_bb = chess.BB_SQUARES[bk]
+            if bk == wk or wk_attacks & bk_bb:
+                continue
+            bk_attacks = chess.BB_KING_ATTACKS[bk]
+            for p in squares:
+                p_bb = chess.BB_SQUARES[p]
+                if p == wk or p == bk:
+                    continue
+                if piece_type == chess.PAWN and p_bb & chess.BB_BACKRANKS:
+                    continue
+                occupied = wk_bb | bk_bb | p_bb
+                piece_attacks = _piece_attacks(piece_type, p, occupied)
+
+                # black to move, king moves off attacked squares or takes
+                # an undefended piece
+                source = index(1, wk, bk, p)
+                attacked = wk_attacks | _piece_attacks(piece_type, p, occupied & ~bk_bb)
+                moves = 0
+                for to in chess.scan_forward(bk_attacks & ~attacked):
+                    black_src.append(source)
+                    black_dst.append(draw if to == p else index(0, wk, to, p))
+                    moves += 1
+                if not moves and attacked & bk_bb:
+                    mates.append(source)
+
+                # white to move, only legal when the black king is not in check
+                if piece_attacks & bk_bb:
+                    continue
+                source = index(0, wk, bk, p)
+                for to in chess.scan_forward(wk_attacks & ~p_bb & ~bk_attacks):
+                    white_src.append(source)
+                    white_dst.append(index(1, to, bk, p))
+                if piece_type != chess.PAWN:
+                    for to in chess.scan_forward(piece_attacks & ~occupied):
+                        white_src.append(source)
+                        white_dst.append(index(1, wk, bk, to))
+                elif not occupied & chess.BB_SQUARES[p + 8]:
+                    to = p + 8
+                    if to >= chess.A8:
+                        for offset in (SIZE, 2 * SIZE, draw - index(1, wk, bk, to)):
+                            white_src.append(source)
+                            white_dst.append(offset + index(1, wk, bk, to))
+                    else:
+                        white_src.append(source)
+                        white_dst.append(index(1, wk, bk, to))
+                        if p < chess.A3 and not occupied & chess.BB_SQUARES[p + 16]:
+                            white_src.append(source)
+                            white_dst.append(index(1, wk, bk, p + 16))
+    as_numpy = lambda a: np.frombuffer(a, dtype=np.int32).astype(np.int64)
+    return tuple(map(as_numpy, (white_src, white_dst, black_src, black_dst, mates)))
+
+
+def generate(piece_type, kqk=None, krk=None):
+    # distance to mate in plies for every index, -1 when white does not
+    # win. KPK needs the finished KQK and KRK tables.
+    white_src, white_dst, black_src, black_dst, mates = _edges(piece_type)
+    values = np.full(3 * SIZE + 1, -1, dtype=np.int16)
+    if kqk is not None:
+        values[SIZE:2 * SIZE] = kqk
+        values[2 * SIZE:3 * SIZE] = krk
+    table = values[:SIZE]
+    table[mates] = 0
+    black_moves = np.bincount(black_src, minlength=SIZE)
+    last_external = int(values[SIZE:].max())
+
+    n, last_new = 1, 0
+    while n <= max(last_new, last_external) + 2:
+        if n % 2:
+            won = white_src[values[white_dst] == n - 1]
+            new = np.unique(won[table[won] < 0])
+        else:
+            won = np.bincount(black_src[values[black_dst] >= 0], minlength=SIZE)
+            new = np.flatnonzero((won == black_moves) & (black_moves > 0) & (table < 0))
+        if len(new):
+            table[new] = n
+            last_new = n
+        n += 1
+    return table.copy()
+
+
+class Bitbases:
+
+    def __init__(self, tables):
+        # tables: {piece type: (wdl bits, dtm bytes)}
+        self.tables = tables
+
+    @classmethod
+    def open(cls, path=BITBASE_DIR):
+        # the tables in path, memory mapped, or None when they are missing
+        tables = {}
+        for name, piece_type in TABLES:
+            try:
+                tables[piece_type] = (np.load(os.path.join(path, f"{name}.wdl.npy"), mmap_mode='r'),
+                                      np.load(os.path.join(path, f"{name}.dtm.npy"), mmap_mode='r'))
+            except FileNotFoundError:
+                return None
+        return cls(tables)
+
+    def probe(self, board):
+        # (result, plies) for a position with three pieces: result is 1 when
+        # white wins, -1 when black wins and 0 for a draw, plies the
+        # distance to mate. None for positions without a table.
+        if board.castling_rights or chess.popcount(board.occupied) != 3:
+            return None
+        for strong in (chess.WHITE, chess.BLACK):
+            pieces = board.occupied_co[strong] & ~board.kings
+            if pieces:
+                break
+        piece_type = board.piece_type_at(chess.lsb(pieces))
+        table = self.tables.get(piece_type)
+        if table is None:
+            return None
+        # flip the board so the strong side is white
+        flip = 0 if strong == chess.WHITE else 56
+        i = index(int(board.turn != strong), board.king(strong) ^ flip, board.king(not strong) ^ flip,
+                  chess.lsb(pieces) ^ flip)
+        wdl, dtm = table
+        if not (wdl[i >> 3] >> (7 - (i & 7))) & 1:
+            return 0, 0
+        return (1 if strong == chess.WHITE else -1), int(dtm[i])
+
+
+def build(path=BITBASE_DIR):
+    os.makedirs(path, exist_ok=True)
+    built = {}
+    for name, piece_type in TABLES:
+        start = time.perf_counter()
+        if piece_type == chess.PAWN:
+            table = generate(piece_type, built[chess.QUEEN], built[chess.ROOK])
+        else:
+            table = generate(piece_type)
+        built[piece_type] = table
+        assert table.max() < 256
+        np.save(os.path.join(path, f"{name}.wdl.npy"), np.packbits(table >= 0))
+        np.save(os.path.join(path, f"{name}.dtm.npy"), np.maximum(table, 0).astype(np.uint8))
+        print(f"{name}: {int((table >= 0).sum())} won positions, longest mate {int(table.max())} plies, "
+              f"{time.perf_counter() - start:.1f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build the KPK, KRK and KQK bitbases")
+    parser.add_argument("--out", default=BITBASE_DIR, help=f"output directory (default {BITBASE_DIR})")
+    args = parser.parse_args(argv)
+    build(args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,8 +6,18 @@ import chess
 import numpy as np
 import chess.polyglot
 import random
+import time
+from collections import OrderedDict
 
 from zobrist_hash import *
+from evaluation import *
+from transposition import *
+from move_order import MoveOrdering
+from see import see, captured_value
+from eval_cache import ScoreCache, EVAL_CACHE_ENTRIES, PAWN_TABLE_ENTRIES
+from opening_book import Book
+from bitbase import Bitbases, BITBASE_DIR
+from search_stats import SearchStats
 
 # [-4, -2, -3, -5, -6, -3, -2, -4],  
 # [-1, -1, -1, -1, -1, -1, -1, -1],  
@@ -40,22 +50,169 @@ PIECE_MAP = {
 
 #depth of search - 1
 lookahead = 4
-#opening book data
-BOOK = chess.polyglot.open_reader("openings/book.bin")
-# analyzed states
-seen_states = {}
+#opening book data, loaded into memory once. A book.npy written by
+#`bench.py book --save openings/book.npy` is preferred when present: it is
+#memory mapped, so engine processes share one copy.
+BOOK_PATH = "openings/book.bin"
+BOOK_CACHE_PATH = "openings/book.npy"
+BOOK = Book.open(BOOK_CACHE_PATH if os.path.exists(BOOK_CACHE_PATH) else BOOK_PATH)
+#KPK, KRK and KQK results, memory mapped (None without the files, see
+#bitbase.py). A won position scores as a mate at its distance to mate.
+BITBASES = Bitbases.open(BITBASE_DIR)
+USE_BITBASES = True
+# analyzed states and move ordering tables, kept between searches
+# TT_MODE "shared": one table for every game
+# TT_MODE "game": one table per game_id, least recently used dropped first
+TT_MODE = "shared"
+MAX_GAME_TABLES = 8
+shared_tt = TranspositionTable(TT_SIZE_MB)
+shared_ordering = MoveOrdering()
+game_tables = OrderedDict()     # game_id -> (TranspositionTable, MoveOrdering)
+# tables used by the running search
+tt = shared_tt
+ordering = shared_ordering
 hit_count = 0
-
-# transposition table entry flags
-TT_EXACT = 0
-TT_LOWERBOUND = 1
-TT_UPPERBOUND = 2
-
-# simple move-ordering helpers
-history_heuristic = {}
-killer_moves = {}
+# static evaluations by zobrist hash and pawn structure scores by pawn
+# key, kept for the life of the process
+USE_EVAL_CACHE = True
+eval_cache = ScoreCache(EVAL_CACHE_ENTRIES)
+pawn_table = ScoreCache(PAWN_TABLE_ENTRIES)
 
 MAX_QUIESCENCE_DEPTH = 8
+# quiescence skips captures that lose material by static exchange, and
+# captures that leave the side DELTA_MARGIN centipawns short of alpha
+# even when the captured piece comes for free
+USE_SEE_PRUNING = True
+USE_DELTA_PRUNING = True
+DELTA_MARGIN = 200
+
+# principal variation search in min_max, aspiration windows at the root.
+# PVS is off: with the pruning in min_max and the root aspiration window
+# the null-window scouts save little, while every move that takes over at
+# a PV node is searched twice, so on the bench positions it costs nodes.
+USE_PVS = False
+USE_ASPIRATION = True
+ASPIRATION_WINDOW = 50      # initial half-width around the last iteration's score
+
+# selective search, each part can be switched off for A/B runs
+USE_NULL_MOVE = True
+NULL_MOVE_REDUCTION = 2     # R, the null move is searched at depth - 1 - R
+USE_LMR = True
+LMR_MIN_DEPTH = 3           # only reduce with at least this much depth left
+LMR_FULL_DEPTH_MOVES = 3    # moves searched at full depth before reducing
+USE_FUTILITY = True
+FUTILITY_MARGINS = (0, 200, 500)    # by remaining depth, in centipawns
+USE_REVERSE_FUTILITY = True
+REVERSE_FUTILITY_MARGIN = 150       # per ply of remaining depth, in centipawns
+# no node searches for a mate longer than one already found nearer the root
+USE_MATE_DISTANCE_PRUNING = True
+
+# time management
+MAX_DEPTH = 64              # iterative deepening limit for timed searches
+CHECK_TIME_EVERY = 16       # nodes between clock reads
+MOVES_TO_GO = 30            # assumed remaining moves when playing on a clock
+MOVE_OVERHEAD_MS = 50       # kept in reserve for move transfer
+STOP_MARGIN_MS = 5          # time to unwind an interrupted search
+DEFAULT_BRANCHING = 4       # iteration time growth before two iterations are known
+deadline = None             # perf_counter() value at which the search stops
+node_count = 0
+qnode_count = 0             # quiescence share of node_count
+iterations = []             # (depth, seconds, nodes, score, pv) per completed iteration
+root_lines = []             # (score, pv) per root move line of the last completed iteration, best first
+cutoff_count = 0            # beta cutoffs in min_max
+first_move_cutoffs = 0      # ... of them by the first move searched
+bitbase_hits = 0            # nodes answered by the bitbases
+hash_history = []           # zobrist hash by ply from the last irreversible game move, then by search ply
+history_base = 0            # index of the search root in hash_history
+repetition_floor = 0        # no repetitions before this index (the last null move)
+last_stats = None           # SearchStats of the last get_best_move call
+profile_times = {}          # seconds by part while profiling, see enable_profiling
+root_best_move = None       # best root move of the running iteration so far
+completed_depth = 0         # depth of the last completed iteration
+last_score = None           # score of the last completed iteration, None when none completed
+stop_event = None           # event-like object, once set the running search stops
+on_iteration = None         # called with (depth, seconds, nodes, score, pv) after each completed iteration
+helper_id = 0               # Lazy SMP helper index, 0 outside helper processes
+VERBOSE = True              # print a summary line after each search
+
+class SearchTimeout(Exception):
+    pass
+
+def allocate_time(movetime_ms=None, clock_ms=None, increment_ms=0):
+    # seconds to spend on a move, or None for a fixed-depth search. With
+    # both a movetime and a clock the smaller allocation wins.
+    budgets = []
+    if movetime_ms is not None:
+        budgets.append(max(movetime_ms, 1))
+    if clock_ms is not None:
+        budget = clock_ms / MOVES_TO_GO + 0.8 * (increment_ms or 0)
+        budget = min(budget, clock_ms / 2) - MOVE_OVERHEAD_MS
+        budgets.append(max(budget, 1))
+    if not budgets:
+        return None
+    return min(budgets) / 1000
+
+def _count_node():
+    global node_count
+    node_count += 1
+    if node_count % CHECK_TIME_EVERY == 0:
+        if deadline is not None and time.perf_counter() >= deadline:
+            raise SearchTimeout()
+        if stop_event is not None and stop_event.is_set():
+            raise SearchTimeout()
+
+def _count_cutoff(index):
+    global cutoff_count, first_move_cutoffs
+    cutoff_count += 1
+    if index == 0:
+        first_move_cutoffs += 1
+
+# Profiling hooks. enable_profiling() swaps the evaluation, hashing, move
+# generation and ordering functions for timed wrappers, so the search pays
+# nothing for them while profiling is off. Totals land in profile_times and
+# in SearchStats.profile.
+_unprofiled = {}
+
+def _timed(part, function):
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile_times[part] += time.perf_counter() - start
+    return timed
+
+def _timed_generator(part, function):
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        result = list(function(*args, **kwargs))
+        profile_times[part] += time.perf_counter() - start
+        return iter(result)
+    return timed
+
+def enable_profiling():
+    if _unprofiled:
+        return
+    for part in ("eval", "hash", "movegen", "ordering"):
+        profile_times[part] = 0.0
+    module = globals()
+    for part, names in (("eval", ("evaluate", "update_terms")),
+                        ("hash", ("process_move", "process_null_move")),
+                        ("ordering", ("order_moves", "_capture_score"))):
+        for name in names:
+            _unprofiled[name] = module[name]
+            module[name] = _timed(part, module[name])
+    _unprofiled["generate_legal_moves"] = chess.Board.generate_legal_moves
+    chess.Board.generate_legal_moves = _timed_generator("movegen", chess.Board.generate_legal_moves)
+
+def disable_profiling():
+    module = globals()
+    for name, function in _unprofiled.items():
+        if name == "generate_legal_moves":
+            chess.Board.generate_legal_moves = function
+        else:
+            module[name] = function
+    _unprofiled.clear()
 
 def _mvv_lva(board, move):
     # Most Valuable Victim - Least Valuable Attacker scoring for captures
@@ -74,7 +231,9 @@ def order_moves(board, moves, tt_move=None, depth=0):
         if tt_move is not None and m == tt_move:
             score += 1_000_000
         if board.is_capture(m):
-            score += 10_000 + _mvv_lva(board, m)
+            gain = see(board, m)
+            # losing captures go behind the quiet moves
+            score += 10_000 + _mvv_lva(board, m) if gain >= 0 else gain * 100 - 2_000
         if m.promotion is not None:
             score += 9_000
         try:
@@ -82,8 +241,8 @@ def order_moves(board, moves, tt_move=None, depth=0):
                 score += 1_000
         except Exception:
             pass
-        score += history_heuristic.get((depth, m), 0)
-        if depth in killer_moves and m in killer_moves[depth]:
+        score += ordering.history_score(board.turn, m) // 64
+        if m in ordering.killer_moves(depth):
             score += 500
         scored.append((score, m))
     scored.sort(key=lambda x: x[0], reverse=True)
@@ -91,86 +250,372 @@ def order_moves(board, moves, tt_move=None, depth=0):
 
 
 
-def min_max(board, depth, alpha, beta, maximizing, current_hash, ply=0):
-    # Transposition table probe
-    if current_hash in seen_states:
-        entry = seen_states[current_hash]
-        if entry["depth"] >= depth:
-            global hit_count
-            hit_count += 1
-            flag = entry["flag"]
-            if flag == TT_EXACT:
-                return entry["score"]
-            if flag == TT_LOWERBOUND and entry["score"] > alpha:
-                alpha = entry["score"]
-            elif flag == TT_UPPERBOUND and entry["score"] < beta:
-                beta = entry["score"]
-            if alpha >= beta:
-                return entry["score"]
+def evaluate(board, current_hash, current_terms):
+    # static eval of the search in centipawns, evaluate_cp plus pawn
+    # structure, through the eval cache and the pawn table
+    if not USE_EVAL_CACHE:
+        return evaluate_cp(board, current_terms) + pawn_structure(board)
+    score = eval_cache.get(current_hash)
+    if score is None:
+        pawn_key = current_terms[2]
+        structure = pawn_table.get(pawn_key)
+        if structure is None:
+            structure = pawn_structure(board)
+            pawn_table.put(pawn_key, structure)
+        score = evaluate_cp(board, current_terms) + structure
+        eval_cache.put(current_hash, score)
+    return score
 
-    if depth == 0 or board.is_game_over():
-        if board.is_checkmate():
-            return float('-inf') if maximizing else float('inf')
-        # Quiescence search to reduce horizon effect
-        return quiescence(board, alpha, beta, maximizing, current_hash, qdepth=0)
+def _capture_score(board, move):
+    # MVV-LVA, or None for a capture that loses material by SEE. An en
+    # passant capture takes a pawn from an empty square.
+    victim = PIECE_VALUES[board.piece_type_at(move.to_square) or chess.PAWN]
+    attacker = PIECE_VALUES[board.piece_type_at(move.from_square)]
+    if attacker > victim and see(board, move) < 0:
+        return None
+    return victim * 100 - attacker
+
+def pick_moves(board, tt_move=None, ply=0, noisy_only=False):
+    # Staged move picker for min_max and quiescence. Each stage is only
+    # generated once the one before is used up, a cutoff usually comes
+    # before the quiet moves are ever generated:
+    #   1. the TT move, checked for legality, nothing generated
+    #   2. captures that don't lose material, by MVV-LVA, then
+    #      non-capturing promotions
+    #   3. this ply's killer moves
+    #   4. the remaining quiet moves by history score
+    #   5. the losing captures
+    # noisy_only (quiescence) stops after stage 2 and skips a quiet TT
+    # move, with USE_SEE_PRUNING also losing captures.
+    if tt_move is not None and board.is_legal(tt_move) and (
+            not noisy_only or tt_move.promotion
+            or (board.is_capture(tt_move) and not (USE_SEE_PRUNING and _capture_score(board, tt_move) is None))):
+        yield tt_move
+    else:
+        tt_move = None
+
+    captures, losing = [], []
+    for move in board.generate_legal_captures():
+        if move != tt_move:
+            score = _capture_score(board, move)
+            if score is None:
+                losing.append(move)
+            else:
+                captures.append((score, move))
+    captures.sort(key=lambda c: c[0], reverse=True)
+    for _, move in captures:
+        yield move
+
+    empty = ~board.occupied
+    promotions = [m for m in board.generate_legal_moves(board.pawns, chess.BB_BACKRANKS & empty) if m != tt_move]
+    promotions.sort(key=lambda m: m.promotion, reverse=True)
+    yield from promotions
+    if noisy_only:
+        if not USE_SEE_PRUNING:
+            yield from losing
+        return
+
+    killers = []
+    for move in ordering.killer_moves(ply):
+        if (move is not None and move != tt_move and not move.promotion and not board.is_capture(move)
+                and board.is_legal(move)):
+            killers.append(move)
+            yield move
+
+    # python-chess checks castling against the rook's square, own rooks
+    # are no target for anything else
+    ep_square = board.ep_square
+    quiets = [m for m in board.generate_legal_moves(chess.BB_ALL, empty | (board.rooks & board.occupied_co[board.turn]))
+              if not m.promotion and m != tt_move and m not in killers
+              and not (m.to_square == ep_square and board.is_en_passant(m))]
+    history = ordering.history
+    side = board.turn << 12
+    quiets.sort(key=lambda m: history[side | m.from_square << 6 | m.to_square], reverse=True)
+    yield from quiets
+    yield from losing
+
+def configure_tables(mode=TT_MODE, size_mb=TT_SIZE_MB, max_games=MAX_GAME_TABLES):
+    global TT_MODE, MAX_GAME_TABLES, shared_tt, tt, ordering
+    if mode not in ("shared", "game"):
+        raise ValueError(f"unknown TT mode {mode!r}")
+    TT_MODE = mode
+    MAX_GAME_TABLES = max_games
+    if size_mb != shared_tt.size_mb:
+        shared_tt = TranspositionTable(size_mb)
+        game_tables.clear()
+    tt = shared_tt
+    ordering = shared_ordering
+
+def tables_for_game(game_id=None, mode=None):
+    # (transposition table, move ordering tables) to search game_id in,
+    # mode overrides TT_MODE
+    if (mode or TT_MODE) != "game" or game_id is None:
+        return shared_tt, shared_ordering
+    tables = game_tables.pop(game_id, None)
+    if tables is None:
+        if len(game_tables) >= MAX_GAME_TABLES:
+            game_tables.popitem(last=False)
+        tables = (TranspositionTable(shared_tt.size_mb), MoveOrdering())
+    game_tables[game_id] = tables
+    return tables
+
+def _null_window_above(alpha):
+    # smallest window (alpha, beta) that still tells "> alpha" from "<= alpha"
+    return alpha + 1
+
+def _null_window_below(beta):
+    return beta - 1
+
+def _score_to_tt(score, ply):
+    # mate scores count plies from the root, the table stores them counted
+    # from the node so they stay right when the node is reached at other plies
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
 
-    best_move = seen_states.get(current_hash, {}).get("move")
+def _score_from_tt(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+def _search_move(board, depth, alpha, beta, maximizing, new_hash, new_terms, ply, first, reduction=0):
+    # Score of the move just pushed, from a node where maximizing was to
+    # move. Later moves are scouted with a null window (PVS) and possibly at
+    # reduced depth (LMR), the reduction is dropped and then the window
+    # widened only when the scout says the move beats alpha / beta.
+    child = not maximizing
+    if first or (not USE_PVS and not reduction):
+        return min_max(board, depth - 1, alpha, beta, child, new_hash, new_terms, ply+1)
+
+    if not USE_PVS:
+        scout_alpha, scout_beta = alpha, beta
+    elif maximizing:
+        scout_alpha, scout_beta = alpha, _null_window_above(alpha)
+    else:
+        scout_alpha, scout_beta = _null_window_below(beta), beta
+
+    score = min_max(board, depth - 1 - reduction, scout_alpha, scout_beta, child, new_hash, new_terms, ply+1)
+    if reduction and (score > alpha if maximizing else score < beta):
+        score = min_max(board, depth - 1, scout_alpha, scout_beta, child, new_hash, new_terms, ply+1)
+    if USE_PVS and alpha < score < beta:
+        score = min_max(board, depth - 1, alpha, beta, child, new_hash, new_terms, ply+1)
+    return score
+
+def _late_move_reduction(board, depth, index, move, in_check, is_capture):
+    # plies to reduce the index-th move by, must be called after the push
+    if (not USE_LMR or depth < LMR_MIN_DEPTH or index < LMR_FULL_DEPTH_MOVES or in_check
+            or is_capture or move.promotion or board.is_check()):
+        return 0
+    return 2 if index >= LMR_FULL_DEPTH_MOVES * 2 and depth > LMR_MIN_DEPTH else 1
+
+def _can_null_move(board, depth, in_check):
+    # no null move in check, twice in a row, or when the side to move has
+    # only king and pawns (zugzwang is likely there)
+    if not USE_NULL_MOVE or in_check or depth <= NULL_MOVE_REDUCTION:
+        return False
+    if board.move_stack and not board.move_stack[-1]:
+        return False
+    return bool(board.occupied_co[board.turn] & ~(board.pawns | board.kings))
+
+def _game_history(board):
+    # hashes of the game positions since the last irreversible move, oldest
+    # first, without the root
+    board = board.copy(stack=min(board.halfmove_clock, len(board.move_stack)))
+    hashes = []
+    while board.move_stack:
+        board.pop()
+        hashes.append(get_board_hash(board))
+    hashes.reverse()
+    return hashes
+
+def _is_repetition(index, halfmove_clock):
+    # Same hash as an earlier position since the last irreversible move.
+    # Only positions with the same side to move can match, and a position
+    # comes back after four plies at the earliest.
+    current_hash = hash_history[index]
+    for earlier in range(index - 4, max(index - halfmove_clock, repetition_floor) - 1, -2):
+        if hash_history[earlier] == current_hash:
+            return True
+    return False
+
+def min_max(board, depth, alpha, beta, maximizing, current_hash, current_terms, ply=0):
+    _count_node()
+    # Draws by repetition, the fifty-move rule or material, from counters
+    # and the hash history instead of board.is_game_over()
+    index = history_base + ply
+    hash_history[index] = current_hash
+    halfmove_clock = board.halfmove_clock
+    if halfmove_clock >= 4 and _is_repetition(index, halfmove_clock):
+        return 0
+    if halfmove_clock >= 100:
+        return 0
+    if not (board.pawns | board.rooks | board.queens) and chess.popcount(board.occupied) <= 3:
+        return 0
+
+    # Mate distance pruning: the best this node can do is mate on the next
+    # ply, the worst is being mated here. Once a shorter mate is known the
+    # window is empty.
+    if USE_MATE_DISTANCE_PRUNING:
+        if maximizing:
+            alpha = max(alpha, ply - MATE)
+            beta = min(beta, MATE - ply - 1)
+        else:
+            alpha = max(alpha, ply + 1 - MATE)
+            beta = min(beta, MATE - ply)
+        if alpha >= beta:
+            return alpha if maximizing else beta
 
+    # Transposition table probe, bounds only cut when they prove the result
+    entry = tt.probe(current_hash)
+    best_move = None
+    if entry is not None:
+        tt_score, tt_depth, flag, best_move = entry
+        tt_score = _score_from_tt(tt_score, ply)
+        if tt_depth >= depth:
+            if (flag == TT_EXACT
+                    or (flag == TT_LOWERBOUND and tt_score >= beta)
+                    or (flag == TT_UPPERBOUND and tt_score <= alpha)):
+                global hit_count
+                hit_count += 1
+                return tt_score
+
+    # exact result of a bitbase ending, no search below
+    if USE_BITBASES and BITBASES is not None and chess.popcount(board.occupied) == 3:
+        probe = BITBASES.probe(board)
+        if probe is not None:
+            global bitbase_hits
+            bitbase_hits += 1
+            result, plies = probe
+            return result * (MATE - ply - plies)
+
+    in_check = board.is_check()
+    if depth == 0:
+        # Mate is only looked for in check, a stalemate at the horizon is
+        # scored by quiescence
+        if in_check and not any(board.generate_legal_moves()):
+            return ply - MATE if maximizing else MATE - ply
+        # Quiescence search to reduce horizon effect
+        return quiescence(board, alpha, beta, maximizing, current_hash, current_terms, qdepth=0)
+
+    static_eval = None
+    if not in_check and (USE_REVERSE_FUTILITY or USE_FUTILITY) and depth <= len(FUTILITY_MARGINS) - 1:
+        static_eval = evaluate(board, current_hash, current_terms)
+
+        # Reverse futility: the static eval is so far past the bound that a
+        # shallow search is not expected to come back
+        if USE_REVERSE_FUTILITY:
+            margin = REVERSE_FUTILITY_MARGIN * depth
+            if maximizing and static_eval - margin >= beta:
+                return static_eval - margin
+            if not maximizing and static_eval + margin <= alpha:
+                return static_eval + margin
+
+    # Null move: let the opponent move twice, if a reduced search still
+    # fails high (low) the real moves will too
+    if _can_null_move(board, depth, in_check):
+        global repetition_floor
+        floor = repetition_floor
+        repetition_floor = index + 1
+        null_hash = process_null_move(current_hash, board)
+        board.push(chess.Move.null())
+        if maximizing:
+            score = min_max(board, depth - 1 - NULL_MOVE_REDUCTION, _null_window_below(beta), beta,
+                            False, null_hash, current_terms, ply+1)
+        else:
+            score = min_max(board, depth - 1 - NULL_MOVE_REDUCTION, alpha, _null_window_above(alpha),
+                            True, null_hash, current_terms, ply+1)
+        board.pop()
+        repetition_floor = floor
+        # a mate found after passing is no proof, only the bound is
+        if maximizing and score >= beta:
+            return score if score < MATE_BOUND else beta
+        if not maximizing and score <= alpha:
+            return score if score > -MATE_BOUND else alpha
+
+    # Futility: near the leaves, quiet moves can't lift a hopeless eval
+    # past the bound, only the first move and noisy moves are searched
+    futile = False
+    if USE_FUTILITY and static_eval is not None:
+        margin = FUTILITY_MARGINS[depth]
+        futile = static_eval + margin <= alpha if maximizing else static_eval - margin >= beta
+
+    alpha_orig, beta_orig = alpha, beta
+    quiets_tried = []
+    i = -1
     if maximizing:
-        value = float('-inf')
-        legal_moves = list(board.legal_moves)
-        for move in order_moves(board, legal_moves, tt_move=best_move, depth=ply):
+        value = -INFINITE
+        for i, move in enumerate(pick_moves(board, best_move, ply)):
+            is_capture = board.is_capture(move)
+            if futile and i > 0 and not is_capture and not move.promotion and not board.gives_check(move):
+                continue
             new_hash = process_move(current_hash, board, move)
+            new_terms = update_terms(current_terms, board, move)
             board.push(move)
-            score = min_max(board, depth - 1, alpha, beta, False, new_hash, ply+1)
+            reduction = _late_move_reduction(board, depth, i, move, in_check, is_capture)
+            score = _search_move(board, depth, alpha, beta, True, new_hash, new_terms, ply, i == 0, reduction)
             board.pop()
             if score > value:
                 value = score
                 best_move = move
             if score > alpha:
                 alpha = score
-                # update history heuristic on beta-improving moves
-                history_heuristic[(ply, move)] = history_heuristic.get((ply, move), 0) + depth * depth
             if alpha >= beta:
-                # store killer move
-                killer_moves.setdefault(ply, set()).add(move)
+                # quiet cutoff moves become killers and gain history over
+                # the quiet moves tried before them
+                if not is_capture and not move.promotion:
+                    ordering.cutoff(board.turn, move, depth, ply, quiets_tried)
+                _count_cutoff(i)
                 break
-        # store TT
-        flag = TT_EXACT
-        if value <= alpha:
-            flag = TT_UPPERBOUND
-        elif value >= beta:
-            flag = TT_LOWERBOUND
-        seen_states[current_hash] = {"score": value, "depth": depth, "flag": flag, "move": best_move}
-        return value
+            if not is_capture and not move.promotion:
+                quiets_tried.append(move)
     else:
-        value = float('inf')
-        legal_moves = list(board.legal_moves)
-        for move in order_moves(board, legal_moves, tt_move=best_move, depth=ply):
+        value = INFINITE
+        for i, move in enumerate(pick_moves(board, best_move, ply)):
+            is_capture = board.is_capture(move)
+            if futile and i > 0 and not is_capture and not move.promotion and not board.gives_check(move):
+                continue
             new_hash = process_move(current_hash, board, move)
+            new_terms = update_terms(current_terms, board, move)
             board.push(move)
-            score = min_max(board, depth - 1, alpha, beta, True, new_hash, ply+1)
+            reduction = _late_move_reduction(board, depth, i, move, in_check, is_capture)
+            score = _search_move(board, depth, alpha, beta, False, new_hash, new_terms, ply, i == 0, reduction)
             board.pop()
             if score < value:
                 value = score
                 best_move = move
             if score < beta:
                 beta = score
-                history_heuristic[(ply, move)] = history_heuristic.get((ply, move), 0) + depth * depth
             if alpha >= beta:
-                killer_moves.setdefault(ply, set()).add(move)
+                if not is_capture and not move.promotion:
+                    ordering.cutoff(board.turn, move, depth, ply, quiets_tried)
+                _count_cutoff(i)
                 break
-        flag = TT_EXACT
-        if value <= alpha:
-            flag = TT_UPPERBOUND
-        elif value >= beta:
-            flag = TT_LOWERBOUND
-        seen_states[current_hash] = {"score": value, "depth": depth, "flag": flag, "move": best_move}
-        return value
-
-def quiescence(board, alpha, beta, maximizing, current_hash, qdepth=0):
+            if not is_capture and not move.promotion:
+                quiets_tried.append(move)
+
+    if i < 0:
+        # no legal moves, mated or stalemate
+        return (ply - MATE if maximizing else MATE - ply) if in_check else 0
+
+    # store TT, bound type relative to the window the node was searched with
+    flag = TT_EXACT
+    if value <= alpha_orig:
+        flag = TT_UPPERBOUND
+    elif value >= beta_orig:
+        flag = TT_LOWERBOUND
+    tt.store(current_hash, _score_to_tt(value, ply), depth, flag, best_move)
+    return value
+
+def quiescence(board, alpha, beta, maximizing, current_hash, current_terms, qdepth=0):
+    global qnode_count
+    qnode_count += 1
+    _count_node()
     # Stand pat
-    stand_pat = evaluate_board(board)
+    stand_pat = evaluate(board, current_hash, current_terms)
     if maximizing:
         if stand_pat >= beta:
             return beta
@@ -186,17 +631,17 @@ def quiescence(board, alpha, beta, maximizing, current_hash, qdepth=0):
         return stand_pat
 
     # Only consider noisy moves
-    tt_move = seen_states.get(current_hash, {}).get("move")
-    captures = [m for m in board.legal_moves if board.is_capture(m) or m.promotion is not None]
-    if not captures:
-        return stand_pat
+    tt_move = tt.get_move(current_hash)
 
     if maximizing:
         value = stand_pat
-        for move in order_moves(board, captures, tt_move=tt_move):
+        for move in pick_moves(board, tt_move, noisy_only=True):
+            if USE_DELTA_PRUNING and stand_pat + captured_value(board, move) * CP_PER_PAWN + DELTA_MARGIN <= alpha:
+                continue
             new_hash = process_move(current_hash, board, move)
+            new_terms = update_terms(current_terms, board, move)
             board.push(move)
-            score = quiescence(board, alpha, beta, False, new_hash, qdepth+1)
+            score = quiescence(board, alpha, beta, False, new_hash, new_terms, qdepth+1)
             board.pop()
             if score > value:
                 value = score
@@ -207,10 +652,13 @@ def quiescence(board, alpha, beta, maximizing, current_hash, qdepth=0):
         return value
     else:
         value = stand_pat
-        for move in order_moves(board, captures, tt_move=tt_move):
+        for move in pick_moves(board, tt_move, noisy_only=True):
+            if USE_DELTA_PRUNING and stand_pat - captured_value(board, move) * CP_PER_PAWN - DELTA_MARGIN >= beta:
+                continue
             new_hash = process_move(current_hash, board, move)
+            new_terms = update_terms(current_terms, board, move)
             board.push(move)
-            score = quiescence(board, alpha, beta, True, new_hash, qdepth+1)
+            score = quiescence(board, alpha, beta, True, new_hash, new_terms, qdepth+1)
             board.pop()
             if score < value:
                 value = score
@@ -220,86 +668,271 @@ def quiescence(board, alpha, beta, maximizing, current_hash, qdepth=0):
                 break
         return value
     
-def get_best_move(board, depth=None):
+def _aspiration_search(board, depth, previous, moves, current_hash, current_terms):
+    # search_root in an aspiration window around previous, the last
+    # iteration's score (None for a full window), widened on the side that
+    # fails until the score lands inside. Returns (score, move).
+    window = ASPIRATION_WINDOW
+    if USE_ASPIRATION and previous is not None and abs(previous) < MATE_BOUND:
+        alpha, beta = previous - window, previous + window
+    else:
+        alpha, beta = -INFINITE, INFINITE
+    while True:
+        value, move = search_root(board, depth, alpha, beta, moves, current_hash, current_terms)
+        if value <= alpha and alpha != -INFINITE:
+            window *= 4
+            alpha = previous - window if window < ASPIRATION_WINDOW * 64 else -INFINITE
+        elif value >= beta and beta != INFINITE:
+            window *= 4
+            beta = previous + window if window < ASPIRATION_WINDOW * 64 else INFINITE
+        else:
+            return value, move
+
+def search_root(board, depth, alpha, beta, moves, current_hash, current_terms):
+    # One iteration over the root moves (best first) inside (alpha, beta).
+    # Returns (score, best move), the score is only a bound when it falls
+    # outside the window.
+    global root_best_move
+    maximizing = board.turn == chess.WHITE
+    best_val = -INFINITE if maximizing else INFINITE
+    best_move = moves[0]
+    for i, move in enumerate(moves):
+        new_hash = process_move(current_hash, board, move)
+        new_terms = update_terms(current_terms, board, move)
+        board.push(move)
+        value = _search_move(board, depth, alpha, beta, maximizing, new_hash, new_terms, 0, i == 0)
+        board.pop()
+        if maximizing:
+            if value > best_val:
+                best_val = value
+                best_move = move
+            alpha = max(alpha, value)
+        else:
+            if value < best_val:
+                best_val = value
+                best_move = move
+            beta = min(beta, value)
+        root_best_move = best_move
+        if alpha >= beta:
+            break
+    return best_val, best_move
+
+def search_root_multipv(board, depth, moves, multipv, current_hash, current_terms):
+    # One iteration ranking the multipv best root moves with exact scores,
+    # returns [(score, move)] best first. Each move is scouted against the
+    # worst line kept so far and only searched with an open window when it
+    # beats it, so the iteration costs little more than a single line.
+    global root_best_move
+    maximizing = board.turn == chess.WHITE
+    lines = []
+    for move in moves:
+        full = len(lines) < multipv
+        if full:
+            alpha, beta = -INFINITE, INFINITE
+        elif maximizing:
+            alpha, beta = lines[-1][0], INFINITE
+        else:
+            alpha, beta = -INFINITE, lines[-1][0]
+        new_hash = process_move(current_hash, board, move)
+        new_terms = update_terms(current_terms, board, move)
+        board.push(move)
+        value = _search_move(board, depth, alpha, beta, maximizing, new_hash, new_terms, 0, full)
+        board.pop()
+        if full or (value > alpha if maximizing else value < beta):
+            lines.append((value, move))
+            lines.sort(key=lambda line: line[0], reverse=maximizing)
+            del lines[multipv:]
+        root_best_move = lines[0][1]
+    return lines
+
+def get_best_move(board, depth=None, use_book=True, game_id=None,
+                  movetime_ms=None, clock_ms=None, increment_ms=0, workers=1, stats=False,
+                  tt_mode=None, root_hash=None, history=None, multipv=1):
+    # Searches to depth, or until the time from movetime_ms / clock_ms +
+    # increment_ms runs out, whichever comes first. A timed search without
+    # a depth deepens until time is up and returns the best move of the
+    # last completed iteration. With workers > 1 the search runs in that
+    # many processes sharing one table (Lazy SMP, see smp.py).
+    # With stats=True returns (move, SearchStats) instead of the move.
+    # tt_mode overrides TT_MODE for this game. root_hash and history, when
+    # the caller keeps them up to date (see game_session.py), spare the
+    # search hashing the board and its history again. With multipv > 1 the
+    # search also ranks the next best root moves (see search), book moves
+    # are skipped since they come without scores.
+    global completed_depth, last_stats
+    completed_depth = 0     # stays 0 for book moves
+    last_stats = SearchStats()
+    budget = allocate_time(movetime_ms, clock_ms, increment_ms)
     if depth is None:
-        depth = lookahead
-    if board.legal_moves.count() == 0:
-        return None
-
-    # Opening book for early moves
-    if board.fullmove_number <= 10:
-        book_move = get_opening_move(board)
-        if book_move:
-            return book_move
-
-    # Reset/prepare search state per root
-    global seen_states, hit_count
-    seen_states = {}
+        depth = lookahead if budget is None else MAX_DEPTH
+
+    move = None
+    if board.legal_moves.count():
+        # Opening book for early moves
+        if use_book and multipv == 1 and board.fullmove_number <= 10:
+            move = get_opening_move(board)
+            if move:
+                last_stats = SearchStats(move=move, book=True)
+
+        if move is None and workers > 1:
+            import smp
+            move = smp.parallel_best_move(board, depth, budget, workers, multipv=multipv)
+        elif move is None:
+            # Reuse the table from earlier searches, entries written before
+            # this root are aged out first
+            table, ordering_tables = tables_for_game(game_id, tt_mode)
+            move = search(board, depth, budget, table, ordering_tables=ordering_tables,
+                          root_hash=root_hash, history=history, multipv=multipv)
+
+    return (move, last_stats) if stats else move
+
+def principal_variation(board, current_hash, length, move=None):
+    # move (the root's best move, which is not stored), then the best moves
+    # stored in the table from there on, at most length moves
+    pv = []
+    for _ in range(length):
+        move = move or tt.get_move(current_hash)
+        if move is None or not board.is_legal(move):
+            break
+        current_hash = process_move(current_hash, board, move)
+        board.push(move)
+        pv.append(move)
+        move = None
+    for _ in pv:
+        board.pop()
+    return pv
+
+def search(board, depth, budget, table, generation=None, ordering_tables=None, root_hash=None, history=None,
+           multipv=1, root_moves=None):
+    # Iterative deepening search of board in table, returns the best move.
+    # budget is in seconds, None searches to depth. ordering_tables default
+    # to shared_ordering. root_hash is board's zobrist hash and history the
+    # hashes since the last irreversible move (as _game_history returns
+    # them), both are computed from the board when not given. root_moves
+    # limits the search to those moves.
+    # With multipv > 1 every iteration ranks the multipv best root moves
+    # with exact scores in one pass (see search_root_multipv), the last
+    # completed ranking is in root_lines.
+    global tt, ordering, hit_count, deadline, node_count, qnode_count, iterations, root_best_move, completed_depth, last_score
+    global root_lines
+    global cutoff_count, first_move_cutoffs, last_stats, bitbase_hits
+    global hash_history, history_base, repetition_floor
+    tt = table
+    tt.new_search(generation)
+    ordering = ordering_tables or shared_ordering
+    ordering.new_search()
+    eval_cache.new_search()
+    pawn_table.new_search()
     hit_count = 0
 
-    current_hash = get_board_hash(board)
+    start = time.perf_counter()
+    deadline = None if budget is None else start + max(budget - STOP_MARGIN_MS / 1000, budget / 2)
+    node_count = 0
+    qnode_count = 0
+    iterations = []
+    root_lines = []
+    cutoff_count = 0
+    first_move_cutoffs = 0
+    bitbase_hits = 0
+    for part in profile_times:
+        profile_times[part] = 0.0
+    root_best_move = None
+    completed_depth = 0
+    root_ply = len(board.move_stack)
+
+    current_hash = get_board_hash(board) if root_hash is None else root_hash
+    current_terms = material_terms(board)
+    hash_history = (_game_history(board) if history is None else list(history)) + [current_hash]
+    history_base = len(hash_history) - 1
+    hash_history += [0] * (MAX_DEPTH + 8)     # one slot per search ply
+    repetition_floor = 0
     best_move = None
-    best_val = float('-inf') if board.turn == chess.WHITE else float('inf')
+    best_val = -INFINITE if board.turn == chess.WHITE else INFINITE
 
     # Simple endgame depth extension heuristic
-    array = board_to_array(board)
-    nonzero = int(np.count_nonzero(array))
-    if board.legal_moves.count() < 15 and nonzero < 8:
+    if board.legal_moves.count() < 15 and chess.popcount(board.occupied) < 8:
         depth = max(depth, 5)
 
     # Iterative deepening to improve move ordering
+    iteration_times = []
     for d in range(1, depth + 1):
-        alpha = float('-inf')
-        beta = float('inf')
-        pv_move = seen_states.get(current_hash, {}).get("move")
-        moves = list(board.legal_moves)
+        if deadline is not None and iteration_times:
+            # don't start an iteration that is not expected to finish
+            if len(iteration_times) >= 2 and iteration_times[-2] > 0:
+                branching = iteration_times[-1] / iteration_times[-2]
+            else:
+                branching = DEFAULT_BRANCHING
+            branching = min(max(branching, 2), 10)
+            if time.perf_counter() + iteration_times[-1] * branching > deadline:
+                break
+
+        iteration_start = time.perf_counter()
+        pv_move = tt.get_move(current_hash)
+        moves = list(board.legal_moves) if root_moves is None else list(root_moves)
         ordered = order_moves(board, moves, tt_move=pv_move, depth=0)
-        if board.turn == chess.WHITE:
-            best_val_iter = float('-inf')
-            best_move_iter = best_move or (ordered[0] if ordered else None)
-            for move in ordered:
-                new_hash = process_move(current_hash, board, move)
-                board.push(move)
-                value = min_max(board, d - 1, alpha, beta, False, new_hash, ply=1)
-                board.pop()
-                if value > best_val_iter:
-                    best_val_iter = value
-                    best_move_iter = move
-                if value > alpha:
-                    alpha = value
-            best_val = best_val_iter
-            best_move = best_move_iter
-        else:
-            best_val_iter = float('inf')
-            best_move_iter = best_move or (ordered[0] if ordered else None)
-            for move in ordered:
-                new_hash = process_move(current_hash, board, move)
-                board.push(move)
-                value = min_max(board, d - 1, alpha, beta, True, new_hash, ply=1)
+        if multipv > 1 and root_lines:
+            # the last iteration's lines first, in their order
+            first = [pv[0] for _, pv in root_lines]
+            ordered = first + [move for move in ordered if move not in first]
+        if helper_id and len(ordered) > 2:
+            # helpers start on different moves so they diverge from the main
+            # search and fill the shared table with other subtrees
+            shift = helper_id % (len(ordered) - 1)
+            ordered = ordered[:1] + ordered[1 + shift:] + ordered[1:1 + shift]
+
+        try:
+            if multipv > 1:
+                lines = search_root_multipv(board, d, ordered, multipv, current_hash, current_terms)
+            else:
+                lines = [_aspiration_search(board, d, best_val if best_move is not None else None, ordered,
+                                            current_hash, current_terms)]
+        except SearchTimeout:
+            # unwind the moves the interrupted search left on the board
+            while len(board.move_stack) > root_ply:
                 board.pop()
-                if value < best_val_iter:
-                    best_val_iter = value
-                    best_move_iter = move
-                if value < beta:
-                    beta = value
-            best_val = best_val_iter
-            best_move = best_move_iter
-
-    print("final score:", best_val, hit_count, len(seen_states))
+            # keep the last completed iteration, the partial one only if
+            # nothing has completed yet
+            if best_move is None:
+                best_move = root_best_move or ordered[0]
+            break
+        root_lines = [(value, principal_variation(board, current_hash, d, move)) for value, move in lines]
+        best_val, best_move = lines[0]
+        pv = root_lines[0][1]
+        completed_depth = d
+        iteration_times.append(time.perf_counter() - iteration_start)
+        iterations.append((d, time.perf_counter() - start, node_count, best_val, pv))
+        if on_iteration is not None and not helper_id:
+            on_iteration(*iterations[-1])
+        # a mate within the full-width depth can't get shorter by going deeper
+        if all(abs(value) >= MATE_BOUND and MATE - abs(value) <= d for value, _ in lines):
+            break
+
+    deadline = None
+    # without a completed iteration best_val is still the +-INFINITE start
+    last_score = best_val if completed_depth else None
+    last_stats = SearchStats(
+        move=best_move, score=last_score, depth=completed_depth, nodes=node_count, qnodes=qnode_count,
+        time_s=time.perf_counter() - start, tt_probes=tt.probes, tt_hits=tt.hits, tt_cutoffs=hit_count,
+        beta_cutoffs=cutoff_count, first_move_cutoffs=first_move_cutoffs,
+        eval_probes=eval_cache.probes, eval_hits=eval_cache.hits,
+        pawn_probes=pawn_table.probes, pawn_hits=pawn_table.hits,
+        iterations=[{'depth': d, 'time_s': round(t, 4), 'nodes': n, 'score': v, 'pv': [m.uci() for m in pv]}
+                    for d, t, n, v, pv in iterations],
+        lines=root_lines, profile=dict(profile_times) if _unprofiled else None)
+    if VERBOSE and not helper_id:
+        print("final score:", last_score, hit_count, len(tt))
     return best_move
 
 def get_opening_move(board: chess.Board) -> chess.Move | None:
     """
     Returns a book move for this position, or None if none found.
     """
-    try:
-        # weighted_choice picks proportionally to entry weights
-        entry = BOOK.weighted_choice(board)
-        return entry.move if entry else None
-    except IndexError:
-        return None
+    # weighted_choice picks proportionally to entry weights
+    return BOOK.weighted_choice(board)
     
-def evaluate_board(board):
+# Reference evaluator walking the 8x8 array. The search uses the bitboard
+# evaluate_board from evaluation.py, bench.py checks the two agree.
+def evaluate_board_array(board):
     score = 0
     array_board = board_to_array(board)
 
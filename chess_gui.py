@@ -1,9 +1,11 @@
 import pygame
 import sys
 import os
+import threading
 import chess
 import numpy as np
 
+import chess_bot
 from chess_bot import *
 
 # Colors
@@ -11,6 +13,42 @@ WHITE = (245, 245, 220)
 GRAY = (119, 136, 153)
 SELECT_HIGHLIGHT = (186, 202, 68)
 MOVE_HIGHLIGHT = (105, 105, 105)
+THINKING_COLOR = (200, 40, 40)
+
+# engine time per move, the search runs in the background
+ENGINE_MOVETIME_MS = 1000
+# ponder on the expected reply while the human thinks
+PONDER = True
+
+
+# One engine search on a copy of board in a daemon thread, so the event
+# loop keeps running. Only one search runs at a time: cancel() stops it
+# through chess_bot.stop_event and waits for it, the best move of the last
+# completed iteration is kept.
+class BackgroundSearch:
+    def __init__(self, board, depth=None, movetime_ms=None):
+        self.board = board.copy()
+        self.depth = depth
+        self.movetime_ms = movetime_ms
+        self.move = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        chess_bot.stop_event = self.stop_event
+        try:
+            self.move = get_best_move(self.board, self.depth, movetime_ms=self.movetime_ms)
+        finally:
+            chess_bot.stop_event = None
+
+    @property
+    def done(self):
+        return not self.thread.is_alive()
+
+    def cancel(self):
+        self.stop_event.set()
+        self.thread.join()
 
 
 # Load images from 'images/' folder. Names: wp.png, wn.png, ... bn.png, etc.
@@ -61,12 +99,23 @@ def draw_pieces(win, board, images):
             c = chess.square_file(square)
             win.blit(images[sym], (c*SQ_SIZE, r*SQ_SIZE))
 
+def draw_thinking(win, font):
+    label = font.render("thinking...", True, THINKING_COLOR)
+    win.blit(label, (4, 4))
+
+# Predicted reply to the engine's last move, the next move of the
+# principal variation left in the transposition table
+def expected_reply(board):
+    move = chess_bot.tt.get_move(get_board_hash(board))
+    return move if move is not None and board.is_legal(move) else None
+
 # Main loop
 def main():
     pygame.init()
     win = pygame.display.set_mode((WIDTH, HEIGHT))
     pygame.display.set_caption('Python Chess')
     clock = pygame.time.Clock()
+    font = pygame.font.SysFont(None, 24)
 
     board = chess.Board()
     images = load_images()
@@ -74,54 +123,75 @@ def main():
 
     selected = None
     legal_moves = []
+    search = None       # engine search for the engine's move
+    ponder = None       # search of the position after the expected reply
 
     running = True
     while running:
         clock.tick(FPS)
 
-
-        if board.turn == chess.WHITE:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    mx, my = pygame.mouse.get_pos()
-                    c = mx // SQ_SIZE
-                    r = my // SQ_SIZE
-                    clicked = chess.square(c, 7 - r)
-                    piece = board.piece_at(clicked)
-                    # If no selection yet, select your piece and show moves
-                    if selected is None:
-                        if piece and piece.color == board.turn:
-                            selected = clicked
-                            # collect dest squares for moves from this square
-                            legal_moves = [m.to_square for m in board.legal_moves if m.from_square == selected]
-                    else:
-                        # If clicked on a legal destination, make that move
-                        if clicked in legal_moves:
-                            # find move object (handle promotions)
-                            move = next((m for m in board.legal_moves
-                                        if m.from_square == selected and m.to_square == clicked), None)
-                            if move:
-                                board.push(move)
-                                board_array = board_to_array(board)
-                        # clear selection in any case
-                        selected = None
-                        legal_moves = []
-        else:
-            move = get_best_move(board)
-
-            if move != None:
-                board.push(move)
-            else:
-                continue
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+            elif event.type == pygame.MOUSEBUTTONDOWN and board.turn == chess.WHITE:
+                mx, my = pygame.mouse.get_pos()
+                c = mx // SQ_SIZE
+                r = my // SQ_SIZE
+                clicked = chess.square(c, 7 - r)
+                piece = board.piece_at(clicked)
+                # If no selection yet, select your piece and show moves
+                if selected is None:
+                    if piece and piece.color == board.turn:
+                        selected = clicked
+                        # collect dest squares for moves from this square
+                        legal_moves = [m.to_square for m in board.legal_moves if m.from_square == selected]
+                else:
+                    # If clicked on a legal destination, make that move
+                    if clicked in legal_moves:
+                        # find move object (handle promotions)
+                        move = next((m for m in board.legal_moves
+                                    if m.from_square == selected and m.to_square == clicked), None)
+                        if move:
+                            board.push(move)
+                            board_array = board_to_array(board)
+                    # clear selection in any case
+                    selected = None
+                    legal_moves = []
+
+        if board.turn == chess.BLACK and not board.is_game_over():
+            if search is None:
+                # Whether or not the human played the expected reply, the
+                # ponder search stops here. On a hit the table already
+                # holds its work, so the real search gets through the
+                # first iterations almost for free.
+                if ponder is not None:
+                    ponder.cancel()
+                    ponder = None
+                search = BackgroundSearch(board, movetime_ms=ENGINE_MOVETIME_MS)
+            elif search.done:
+                move = search.move
+                search = None
+                if move is not None:
+                    board.push(move)
+                    board_array = board_to_array(board)
+                    reply = expected_reply(board) if PONDER else None
+                    if reply is not None:
+                        board.push(reply)
+                        ponder = BackgroundSearch(board, depth=MAX_DEPTH)
+                        board.pop()
 
         draw_board(win)
         draw_highlights(win, selected, legal_moves)
         draw_pieces(win, board, images)
+        if search is not None:
+            draw_thinking(win, font)
         pygame.display.flip()
 
+    for running_search in (search, ponder):
+        if running_search is not None:
+            running_search.cancel()
+
     pygame.quit()
     sys.exit()
 
@@ -0,0 +1,370 @@
+import atexit
+import itertools
+import multiprocessing as mp
+import queue
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import chess
+
+from game_session import GameSession, SessionStore
+from search_stats import SearchMetrics, iteration_dict
+
+# Engine worker pool
+#
+# The search keeps its state in chess_bot module globals (tables, killer
+# and history moves, the deadline), so two searches must never run in the
+# same process at once. The pool runs searches in long-lived engine
+# processes, one search at a time each. Every process keeps its own warm
+# transposition tables and opened book between jobs.
+#
+# Jobs for the same game_id always go to the same process so per-game
+# state stays warm, jobs without a game go to the least busy process.
+# submit() refuses new jobs with EngineBusy once max_pending jobs are
+# queued or running, callers wait on or poll the returned Job.
+#
+# Engines report every completed iterative deepening iteration, collected
+# in Job.iterations while the search runs. stop() makes a job's search
+# return the best move it has so far: each engine has a shared stop slot,
+# and the search of a job stops once its number is written there. The slot
+# is only written for the job an engine is running, a stop requested while
+# the job is still queued is applied when it starts.
+#
+# An engine process that dies fails the jobs it had queued or running and
+# is started again, with cold tables.
+#
+# Jobs of a game session (see game_session.py) carry the session's start
+# position and moves instead of a bare FEN. The engine keeps its own copy
+# of every session pinned to it, at most as many as it keeps game tables,
+# and searches them in their game's tables. After answering a session job
+# with nothing else queued, the engine ponders on the game for up to
+# ponder_ms and stops as soon as the next task arrives.
+
+DEFAULT_MAX_PENDING = 64
+MAX_FINISHED_JOBS = 1000    # finished jobs kept around for polling
+ENGINE_POLL_S = 1.0         # seconds without results between checks that the engines are alive
+
+
+class EngineBusy(Exception):
+    pass
+
+
+class Job:
+    # one search request, filled in by the pool's result thread
+
+    def __init__(self, job_id, worker, fen, move, params, session=None):
+        self.id = job_id
+        self.worker = worker
+        self.fen = fen
+        self.human_move = move
+        self.params = params    # get_best_move keyword arguments
+        self.session = session  # (start fen, UCI moves) of a session job, None otherwise
+        self.submitted = time.perf_counter()
+        self.finished = None
+        self.result = None      # dict with 'move', 'fen', 'depth' (0 for book moves) and 'stats' once done
+        self.error = None
+        self.iterations = []    # search_stats.iteration_dict of each completed iteration so far
+        self.started = False
+        self.stop_requested = False
+        self._done = threading.Event()
+        self._progress = threading.Condition()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def latency(self):
+        if self.finished is None:
+            return None
+        return self.finished - self.submitted
+
+    @property
+    def number(self):
+        return int(self.id, 16)
+
+    def wait(self, timeout=None):
+        # True once the job finished (successfully or not)
+        return self._done.wait(timeout)
+
+    def wait_progress(self, seen, timeout=None):
+        # True once more than seen iterations arrived or the job finished
+        with self._progress:
+            return self._progress.wait_for(lambda: len(self.iterations) > seen or self.done, timeout)
+
+    def status(self):
+        if not self.done:
+            return {'job_id': self.id, 'status': 'pending', 'iterations': list(self.iterations)}
+        if self.error is not None:
+            return {'job_id': self.id, 'status': 'error', 'error': self.error}
+        return dict(self.result, job_id=self.id, status='done')
+
+
+class _TaskWaiting:
+    # event-like for chess_bot.stop_event, set once the engine has a task
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+
+    def is_set(self):
+        return not self.tasks.empty()
+
+
+class _JobStop:
+    # event-like stop flag of one job for chess_bot.stop_event, set once
+    # the job's number is in the engine's stop slot
+
+    def __init__(self, slot, number):
+        self.slot = slot
+        self.number = number
+
+    def is_set(self):
+        return self.slot.value == self.number
+
+
+def _engine_session(sessions, game_id, start_fen, moves):
+    # the engine's copy of a session caught up with moves, rebuilt when it
+    # is missing or out of step
+    import chess_bot
+    session = sessions.get(game_id)
+    if session is None or session.start_fen != start_fen or not session.sync(moves):
+        session = GameSession(game_id, start_fen)
+        session.sync(moves)
+        for dropped in sessions.add(session):
+            chess_bot.game_tables.pop(dropped, None)
+    return session
+
+
+def _engine_main(index, tasks, results, stop_slot, tt_mode, tt_mb, max_games, search_workers, ponder_ms, profile):
+    # Tasks are ("search", job_id, fen, move, params, session) and ("end",
+    # game_id), which drops a session. Messages on results are (job_id,
+    # kind, payload): "started", then one "iteration" per completed
+    # iteration, then "done" with the result or "error" with the message.
+    # importing chess_bot opens the book and allocates the tables once
+    import chess_bot
+    chess_bot.configure_tables(tt_mode, tt_mb, max_games)
+    if profile:
+        chess_bot.enable_profiling()
+    sessions = SessionStore(max_games)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        if task[0] == "end":
+            sessions.remove(task[1])
+            chess_bot.game_tables.pop(task[1], None)
+            continue
+        _, job_id, fen, move_uci, params, session = task
+        results.put((job_id, "started", None))
+        chess_bot.stop_event = _JobStop(stop_slot, int(job_id, 16))
+        # multipv searches report every iteration's lines too
+        lines = params.get('multipv', 1) > 1
+        chess_bot.on_iteration = lambda *iteration: results.put(
+            (job_id, "iteration", iteration_dict(*iteration, lines=chess_bot.root_lines if lines else None)))
+        ponder_game = None
+        try:
+            if session is not None:
+                game = _engine_session(sessions, params['game_id'], *session)
+                board = game.board
+                ai_move, stats = chess_bot.get_best_move(board, workers=search_workers, stats=True, tt_mode="game",
+                                                         root_hash=game.hash, history=game.history, **params)
+            else:
+                board = chess.Board(fen)
+                if move_uci:
+                    board.push_uci(move_uci)
+                ai_move, stats = chess_bot.get_best_move(board, workers=search_workers, stats=True, **params)
+            if ai_move is None:
+                raise ValueError("no legal moves")
+            if session is not None:
+                game.push(ai_move)
+                ponder_game = game
+            else:
+                board.push(ai_move)
+            results.put((job_id, "done", {'move': ai_move.uci(), 'fen': board.fen(),
+                                          'depth': chess_bot.completed_depth, 'stats': stats.to_dict()}))
+        except Exception as e:
+            if session is not None:
+                sessions.remove(params['game_id'])
+            results.put((job_id, "error", f"{type(e).__name__}: {e}"))
+        finally:
+            chess_bot.stop_event = None
+            chess_bot.on_iteration = None
+        if ponder_game is not None and ponder_ms and tasks.empty() and not ponder_game.board.is_game_over():
+            ponder_game.ponder(ponder_ms, _TaskWaiting(tasks))
+
+
+class EnginePool:
+
+    def __init__(self, processes, max_pending=DEFAULT_MAX_PENDING,
+                 tt_mode="shared", tt_mb=16, max_games=8, search_workers=1, ponder_ms=0, profile=False):
+        self._ctx = mp.get_context("spawn")
+        self._engine_args = (tt_mode, tt_mb, max_games, search_workers, ponder_ms, profile)
+        self.processes = [None] * processes
+        self.tasks = [None] * processes
+        self.stop_slots = [None] * processes
+        self.pending = [0] * processes
+        self.max_pending = max_pending
+        self.jobs = {}
+        self.finished = OrderedDict()
+        self.metrics = SearchMetrics()     # totals over every finished search
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._closing = False
+        self.results = self._ctx.Queue()
+        for index in range(processes):
+            self._start_engine(index)
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _start_engine(self, index):
+        tasks = self._ctx.Queue()
+        stop_slot = self._ctx.Value('q', 0)     # number of the job to stop
+        # not daemonic, so engines may start lazy SMP helpers of their own
+        process = self._ctx.Process(target=_engine_main,
+                                    args=(index, tasks, self.results, stop_slot, *self._engine_args))
+        process.start()
+        self.tasks[index] = tasks
+        self.stop_slots[index] = stop_slot
+        self.processes[index] = process
+
+    def _check_engines(self):
+        # fail the jobs of engines that died and start them again
+        for index, process in enumerate(self.processes):
+            if process.is_alive() or self._closing:
+                continue
+            with self._lock:
+                lost = [job for job in self.jobs.values() if job.worker == index]
+                self._start_engine(index)
+            for job in lost:
+                self._finish(job.id, None, f"engine process {index} died (exit code {process.exitcode})")
+
+    def _pick_worker(self, game_id):
+        if game_id is not None:
+            return zlib.crc32(str(game_id).encode()) % len(self.processes)
+        return min(range(len(self.processes)), key=self.pending.__getitem__)
+
+    def submit(self, fen, move=None, game_id=None, session=None, **params):
+        # Queue a search of fen (after the human move, if any), or with
+        # session=(start fen, UCI moves) of game_id's session. params go to
+        # chess_bot.get_best_move. Raises EngineBusy when the pool is full.
+        with self._lock:
+            if sum(self.pending) >= self.max_pending:
+                raise EngineBusy(f"{self.max_pending} searches already pending")
+            worker = self._pick_worker(game_id)
+            job = Job(f"{next(self._ids):x}", worker, fen, move, dict(params, game_id=game_id), session)
+            self.jobs[job.id] = job
+            self.pending[worker] += 1
+            # under the lock, so an engine restart can't swap the queue in between
+            self.tasks[worker].put(("search", job.id, fen, move, job.params, session))
+        return job
+
+    def end_game(self, game_id):
+        # the engine game_id is pinned to drops its copy of the session and
+        # the game's tables
+        self.tasks[self._pick_worker(game_id)].put(("end", game_id))
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id) or self.finished.get(job_id)
+
+    def stop(self, job_id):
+        # Ask the search of a queued or running job to return its best move
+        # so far. False when the job is unknown or already finished.
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            job.stop_requested = True
+            if job.started:
+                self.stop_slots[job.worker].value = job.number
+        return True
+
+    def _collect(self):
+        checked = time.monotonic()
+        while True:
+            if time.monotonic() - checked >= ENGINE_POLL_S:
+                self._check_engines()
+                checked = time.monotonic()
+            try:
+                item = self.results.get(timeout=ENGINE_POLL_S)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            job_id, kind, payload = item
+            if kind == "started":
+                with self._lock:
+                    job = self.jobs.get(job_id)
+                    if job is not None:
+                        job.started = True
+                        if job.stop_requested:
+                            self.stop_slots[job.worker].value = job.number
+                continue
+            if kind == "iteration":
+                job = self.get(job_id)
+                if job is not None and not job.done:
+                    with job._progress:
+                        job.iterations.append(payload)
+                        job._progress.notify_all()
+                continue
+            if kind == "done":
+                self._finish(job_id, payload, None)
+            else:
+                self._finish(job_id, None, payload)
+
+    def _finish(self, job_id, result, error):
+        # record a job's result or error, once; late messages of a job
+        # already failed with its engine are dropped
+        with self._lock:
+            job = self.jobs.pop(job_id, None)
+            if job is None:
+                return
+            self.pending[job.worker] -= 1
+            self.finished[job_id] = job
+            if len(self.finished) > MAX_FINISHED_JOBS:
+                self.finished.popitem(last=False)
+        if result is not None:
+            self.metrics.observe(result['stats'])
+        job.result = result
+        job.error = error
+        job.finished = time.perf_counter()
+        with job._progress:
+            job._done.set()
+            job._progress.notify_all()
+
+    def close(self):
+        self._closing = True
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.results.put(None)
+        self._collector.join(timeout=5)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(processes, **kwargs):
+    # the process-wide pool, started on first use
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+        _pool = EnginePool(processes, **kwargs)
+        # registered after the processes started, so this runs before
+        # multiprocessing's own exit handler waits for them
+        atexit.register(close_pool)
+        return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
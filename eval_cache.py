@@ -0,0 +1,56 @@
+from array import array
+
+# Evaluation caches
+#
+# Fixed-size direct-mapped tables of (key, centipawn score), the key picks
+# the slot and a new key simply overwrites it. chess_bot keeps two: the eval cache,
+# keyed by the position's zobrist hash, holds full static evaluations, and
+# the pawn table, keyed by the pawn-only zobrist key, holds pawn structure
+# scores (pawn structure changes far less often than the position). Scores
+# depend on nothing but the position, so entries stay valid across
+# searches and games and the tables are never cleared between them.
+
+EVAL_CACHE_ENTRIES = 1 << 16
+PAWN_TABLE_ENTRIES = 1 << 14
+
+
+class ScoreCache:
+
+    def __init__(self, entries):
+        if entries & (entries - 1):
+            raise ValueError(f"entries must be a power of two, not {entries}")
+        self.mask = entries - 1
+        self.keys = array('Q', bytes(8 * entries))
+        self.scores = array('i', bytes(4 * entries))
+        self.probes = 0
+        self.hits = 0
+
+    @property
+    def memory_bytes(self):
+        return (self.keys.itemsize + self.scores.itemsize) * len(self.keys)
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * len(self.keys)))
+        self.new_search()
+
+    def new_search(self):
+        # entries are kept, only the counters restart
+        self.probes = 0
+        self.hits = 0
+
+    def get(self, key):
+        self.probes += 1
+        index = key & self.mask
+        if self.keys[index] == key:
+            self.hits += 1
+            return self.scores[index]
+        return None
+
+    def put(self, key, score):
+        index = key & self.mask
+        self.keys[index] = key
+        self.scores[index] = score
@@ -0,0 +1,195 @@
+import chess
+
+from zobrist_hash import PIECE_KEYS, NUM_SQUARES, get_pawn_hash
+
+# Bitboard evaluation
+#
+# Produces exactly the same scores as the array walk in chess_bot
+# (count_material + development + pawn_push), but reads the python-chess
+# bitboards directly. Material and the pawn file table only change when a
+# move captures, promotes or moves a pawn, so they are carried through the
+# search as incremental (material, pawns, pawn key) terms next to the
+# zobrist hash. Development depends on occupancy and is recomputed from
+# attack masks.
+#
+# The search scores in integer centipawns: evaluate_cp is evaluate_board
+# times CP_PER_PAWN, computed without floats. Scores of MATE_BOUND and up
+# are mates, MATE - n for mating in n plies (negated for being mated).
+# pawn_structure is a separate centipawn term the array walk does not
+# have, the search adds it to evaluate_cp and caches it by pawn key.
+
+# material values indexed by piece type (pawn = 1 ... king = 6)
+PIECE_VALUES = [0, 1, 3, 3, 5, 9, 10000]
+
+CP_PER_PAWN = 100
+MATE = 32000
+MATE_BOUND = MATE - 256     # longest mate a score can carry, in plies
+INFINITE = MATE + 1         # window bound past every score
+
+# pawn_push file bonuses. Black's table is mirrored one file toward the
+# kingside and, like the original, is credited to white.
+PAWN_FILE_BONUS = {
+    chess.WHITE: [0, 0, 0, 1, 2, 1, 0, 0],
+    chess.BLACK: [0, 0, 0, 0, 1, 2, 1, 0],
+}
+
+# piece-square tables for the pawn term, access PAWN_PST[color][square]
+PAWN_PST = {
+    color: [bonus[chess.square_file(sq)] for sq in chess.SQUARES]
+    for color, bonus in PAWN_FILE_BONUS.items()
+}
+
+# pawn structure terms, in centipawns. Passed pawn bonus by rank from the
+# pawn's own side.
+DOUBLED_PAWN = -15
+ISOLATED_PAWN = -10
+PASSED_PAWN = [0, 5, 10, 20, 35, 60, 100, 0]
+
+_ADJACENT_FILES = [
+    (chess.BB_FILES[file - 1] if file > 0 else 0) | (chess.BB_FILES[file + 1] if file < 7 else 0)
+    for file in range(8)
+]
+
+
+def _front_span(color, square):
+    # squares ahead of a pawn on its own and the adjacent files
+    file, rank = chess.square_file(square), chess.square_rank(square)
+    ranks = range(rank + 1, 8) if color == chess.WHITE else range(rank)
+    files = chess.BB_FILES[file] | _ADJACENT_FILES[file]
+    return files & sum(chess.BB_RANKS[r] for r in ranks)
+
+
+# a pawn is passed when no enemy pawn stands in its front span
+_PASSED_MASKS = {color: [_front_span(color, sq) for sq in chess.SQUARES] for color in chess.COLORS}
+
+_PAWN_BONUS_1 = {
+    chess.WHITE: chess.BB_FILE_D | chess.BB_FILE_F,
+    chess.BLACK: chess.BB_FILE_E | chess.BB_FILE_G,
+}
+_PAWN_BONUS_2 = {
+    chess.WHITE: chess.BB_FILE_E,
+    chess.BLACK: chess.BB_FILE_F,
+}
+
+
+def material_terms(board):
+    # (material, pawns, pawn key) computed from scratch
+    white = board.occupied_co[chess.WHITE]
+    black = board.occupied_co[chess.BLACK]
+
+    material = 0
+    for piece_type, bb in ((chess.PAWN, board.pawns), (chess.KNIGHT, board.knights),
+                           (chess.BISHOP, board.bishops), (chess.ROOK, board.rooks),
+                           (chess.QUEEN, board.queens), (chess.KING, board.kings)):
+        material += PIECE_VALUES[piece_type] * (chess.popcount(bb & white) - chess.popcount(bb & black))
+
+    pawns = 0
+    for color, side in ((chess.WHITE, white), (chess.BLACK, black)):
+        side_pawns = board.pawns & side
+        pawns += chess.popcount(side_pawns & _PAWN_BONUS_1[color])
+        pawns += 2 * chess.popcount(side_pawns & _PAWN_BONUS_2[color])
+
+    return material, pawns, get_pawn_hash(board)
+
+
+def update_terms(terms, board, move):
+    # (material, pawns, pawn key) after move, must be called before board.push(move)
+    material, pawns, pawn_key = terms
+    color = board.turn
+    sign = 1 if color == chess.WHITE else -1
+    origin = move.from_square
+    destination = move.to_square
+    piece_type = board.piece_type_at(origin)
+
+    if board.is_castling(move):
+        return terms
+
+    # pawn keys are PIECE_KEYS[<color offset> + square]
+    own_pawns = int(color) * NUM_SQUARES
+    other_pawns = int(not color) * NUM_SQUARES
+
+    if board.is_en_passant(move):
+        captured_square = destination - 8 if color == chess.WHITE else destination + 8
+        material += sign * PIECE_VALUES[chess.PAWN]
+        pawns -= PAWN_PST[not color][captured_square]
+        pawn_key ^= PIECE_KEYS[other_pawns + captured_square]
+    else:
+        captured = board.piece_type_at(destination)
+        if captured:
+            material += sign * PIECE_VALUES[captured]
+            if captured == chess.PAWN:
+                pawns -= PAWN_PST[not color][destination]
+                pawn_key ^= PIECE_KEYS[other_pawns + destination]
+
+    if piece_type == chess.PAWN:
+        pawns -= PAWN_PST[color][origin]
+        pawn_key ^= PIECE_KEYS[own_pawns + origin]
+        if move.promotion:
+            material += sign * (PIECE_VALUES[move.promotion] - PIECE_VALUES[chess.PAWN])
+        else:
+            pawns += PAWN_PST[color][destination]
+            pawn_key ^= PIECE_KEYS[own_pawns + destination]
+
+    return material, pawns, pawn_key
+
+
+def development_terms(board):
+    # Attacked squares of knights and bishops, white minus black. The array
+    # walk passes the array row (7 - rank) to chess.square, so each minor
+    # piece is credited with the attacks of whatever stands on its vertically
+    # mirrored square. Kept as-is so scores do not change.
+    score = 0
+    minors = board.knights | board.bishops
+    for color, sign in ((chess.WHITE, 1), (chess.BLACK, -1)):
+        for sq in chess.scan_forward(minors & board.occupied_co[color]):
+            score += sign * chess.popcount(board.attacks_mask(chess.square_mirror(sq)))
+    return score
+
+
+def pawn_structure(board):
+    # doubled, isolated and passed pawns, white minus black, in centipawns
+    score = 0
+    for color, sign in ((chess.WHITE, 1), (chess.BLACK, -1)):
+        own = board.pawns & board.occupied_co[color]
+        other = board.pawns & board.occupied_co[not color]
+        for file, file_mask in enumerate(chess.BB_FILES):
+            count = chess.popcount(own & file_mask)
+            if count > 1:
+                score += sign * DOUBLED_PAWN * (count - 1)
+            if count and not own & _ADJACENT_FILES[file]:
+                score += sign * ISOLATED_PAWN * count
+        for square in chess.scan_forward(own):
+            if not other & _PASSED_MASKS[color][square]:
+                score += sign * PASSED_PAWN[chess.square_rank(square) if color == chess.WHITE
+                                            else 7 - chess.square_rank(square)]
+    return score
+
+
+def evaluate_board(board, terms=None):
+    if terms is None:
+        terms = material_terms(board)
+    material, pawns, _ = terms
+
+    # same operation order as the array evaluator so floats match exactly
+    score = 0
+    score += material
+    score += development_terms(board) * 0.1
+    score += pawns * 0.1
+
+    return score
+
+
+def evaluate_cp(board, terms=None):
+    # evaluate_board in centipawns, exact integers
+    if terms is None:
+        terms = material_terms(board)
+    material, pawns, _ = terms
+    return CP_PER_PAWN * material + (CP_PER_PAWN // 10) * (development_terms(board) + pawns)
+
+
+def mate_in(score):
+    # moves to mate for a mate score, negative when white is mated, else None
+    if score is None or abs(score) < MATE_BOUND:
+        return None
+    moves = (MATE - abs(score) + 1) // 2
+    return moves if score > 0 else -moves
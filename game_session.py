@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import OrderedDict
+
+import chess
+
+from zobrist_hash import get_board_hash, process_move
+
+# Game sessions
+#
+# A session is a game kept alive between requests instead of being rebuilt
+# from a FEN every move: the live board with its move stack, its zobrist
+# hash updated move by move and the hashes since the last pawn move or
+# capture, which the search needs to see repetitions. The server keeps the
+# authoritative copy of each session. The engine a session is pinned to
+# keeps its own copy next to the game's search tables and only plays the
+# moves it has not seen yet. While idle, the engine ponders: it searches
+# the position after the reply its tables expect, so when the human plays
+# that move the next search starts from a warm table.
+#
+# SessionStore keeps sessions by game id, least recently used first.
+# Sessions idle for more than ttl_s expire, and the least recently used
+# ones are evicted beyond max_sessions. Both return the dropped game ids
+# so the caller can free what it keeps for them.
+
+
+class GameSession:
+
+    def __init__(self, game_id, fen=chess.STARTING_FEN):
+        self.game_id = game_id
+        self.start_fen = fen
+        self.board = chess.Board(fen)
+        self.hash = get_board_hash(self.board)
+        self.history = []       # hashes since the last zeroing move, oldest first, without the current one
+        self.moves = []         # UCI moves played since start_fen
+        self._undo = []         # (hash, history before a zeroing move or None) per move
+        self.job_id = None      # engine search for this game in progress, if any
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def fen(self):
+        return self.board.fen()
+
+    def push(self, move):
+        if self.board.is_zeroing(move):
+            self._undo.append((self.hash, self.history))
+            self.history = []
+        else:
+            self._undo.append((self.hash, None))
+            self.history.append(self.hash)
+        self.hash = process_move(self.hash, self.board, move)
+        self.board.push(move)
+        self.moves.append(move.uci())
+
+    def pop(self):
+        # take back the last move
+        self.hash, history = self._undo.pop()
+        if history is None:
+            self.history.pop()
+        else:
+            self.history = history
+        self.moves.pop()
+        return self.board.pop()
+
+    def ponder(self, movetime_ms, stop_event=None):
+        # Search the position after the reply the game's tables expect for
+        # up to movetime_ms, or until stop_event is set. Returns the
+        # pondered reply, None when there is none.
+        import chess_bot
+        table, _ = chess_bot.tables_for_game(self.game_id, "game")
+        reply = table.get_move(self.hash)
+        if reply is None or not self.board.is_legal(reply):
+            return None
+        self.push(reply)
+        saved, chess_bot.stop_event = chess_bot.stop_event, stop_event
+        try:
+            chess_bot.get_best_move(self.board, use_book=False, game_id=self.game_id, movetime_ms=movetime_ms,
+                                    tt_mode="game", root_hash=self.hash, history=self.history)
+        finally:
+            chess_bot.stop_event = saved
+            self.pop()
+        return reply
+
+    def sync(self, moves):
+        # Catch up with moves, the UCI moves of the same game from another
+        # copy of the session. False when this copy is not a prefix of it.
+        if self.moves != moves[:len(self.moves)]:
+            return False
+        for uci in moves[len(self.moves):]:
+            self.push(chess.Move.from_uci(uci))
+        return True
+
+
+class SessionStore:
+
+    def __init__(self, max_sessions, ttl_s=None):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.sessions = OrderedDict()     # game_id -> GameSession, least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def add(self, session):
+        # store session, returns the game ids expired or evicted to make room
+        with self._lock:
+            dropped = self._expire()
+            self.sessions[session.game_id] = session
+            self.sessions.move_to_end(session.game_id)
+            while len(self.sessions) > self.max_sessions:
+                dropped.append(self.sessions.popitem(last=False)[0])
+        return dropped
+
+    def get(self, game_id):
+        # the session marked as just used, None when unknown
+        with self._lock:
+            session = self.sessions.get(game_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+                self.sessions.move_to_end(game_id)
+            return session
+
+    def remove(self, game_id):
+        with self._lock:
+            return self.sessions.pop(game_id, None)
+
+    def expire(self):
+        # drop idle sessions, returns their game ids
+        with self._lock:
+            return self._expire()
+
+    def _expire(self):
+        dropped = []
+        if self.ttl_s is None:
+            return dropped
+        cutoff = time.monotonic() - self.ttl_s
+        while self.sessions:
+            game_id, session = next(iter(self.sessions.items()))
+            if session.last_used > cutoff:
+                break
+            del self.sessions[game_id]
+            dropped.append(game_id)
+        return dropped
@@ -0,0 +1,129 @@
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import chess
+
+from bench import percentile
+
+# Load test for the web server
+#
+# Plays --games games at once against /api/move, each game in its own
+# thread making random legal moves for the human side, and reports move
+# throughput and latency percentiles. Without --url the server is started
+# in this process on a free port. With --sessions the games are played as
+# game sessions (/api/games) instead of sending a FEN every move.
+
+
+def request_json(url, payload=None):
+    data = None if payload is None else json.dumps(payload).encode()
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status, json.loads(response.read()), response.headers
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}'), e.headers
+
+
+def play_game(url, args, seed, stats, lock):
+    rng = random.Random(seed)
+    if args.sessions:
+        status, game, _ = request_json(f"{url}/api/games", {})
+    else:
+        status, game, _ = request_json(f"{url}/api/new_game")
+    board = chess.Board(game['fen'])
+    for _ in range(args.moves):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        human = rng.choice(moves)
+        board.push(human)
+        if board.is_game_over():
+            break
+        if args.sessions:
+            move_url = f"{url}/api/games/{game['game_id']}/move"
+            payload = {'move': human.uci()}
+        else:
+            move_url = f"{url}/api/move"
+            payload = {'fen': board.fen(), 'game_id': game['game_id']}
+        if args.depth:
+            payload['depth'] = args.depth
+        else:
+            payload['movetime_ms'] = args.movetime
+
+        start = time.perf_counter()
+        while True:
+            status, reply, headers = request_json(move_url, payload)
+            if status != 503:
+                break
+            with lock:
+                stats['rejected'] += 1
+            time.sleep(float(headers.get('Retry-After', 1)))
+        # waited too long in the queue, poll for the result
+        while status == 202:
+            time.sleep(0.05)
+            status, reply, _ = request_json(f"{url}/api/job/{reply['job_id']}")
+        latency = time.perf_counter() - start
+
+        with lock:
+            if status != 200:
+                stats['errors'] += 1
+                return
+            stats['latencies'].append(latency)
+        board.push_uci(reply['move'])
+
+
+def start_server():
+    # threaded server on a free port, returns its url
+    from werkzeug.serving import make_server
+
+    import server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    server.engines()    # start the engines before the clock runs
+    return f"http://127.0.0.1:{httpd.server_port}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="concurrent games against the Chesser web server")
+    parser.add_argument("--url", help="running server, e.g. http://127.0.0.1:5000")
+    parser.add_argument("--games", type=int, default=16)
+    parser.add_argument("--moves", type=int, default=10, help="engine moves per game")
+    parser.add_argument("--movetime", type=int, default=100, help="ms per engine move")
+    parser.add_argument("--depth", type=int, help="fixed depth instead of --movetime")
+    parser.add_argument("--seed", type=int, default=718)
+    parser.add_argument("--sessions", action="store_true", help="play through game sessions")
+    args = parser.parse_args(argv)
+
+    url = args.url or start_server()
+    stats = {'latencies': [], 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=play_game, args=(url, args, args.seed + i, stats, lock))
+               for i in range(args.games)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = [t * 1000 for t in stats['latencies']]
+    if not latencies:
+        print("no moves completed")
+        return 1
+    print(f"{args.games} games, {len(latencies)} moves in {elapsed:.2f}s: {len(latencies) / elapsed:.2f} moves/s")
+    print(f"latency p50 {percentile(latencies, 50):7.1f}ms  p95 {percentile(latencies, 95):7.1f}ms  "
+          f"p99 {percentile(latencies, 99):7.1f}ms  max {max(latencies):7.1f}ms")
+    print(f"rejected (503) {stats['rejected']}, errors {stats['errors']}")
+    return 0 if not stats['errors'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
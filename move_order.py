@@ -0,0 +1,69 @@
+from array import array
+
+from transposition import encode_move, decode_move
+
+# Move ordering tables
+#
+# History: one score per (side to move, from square, to square) for quiet
+# moves. A quiet move that causes a beta cutoff gets a bonus, the quiet
+# moves searched before it without cutting get the same amount as a
+# penalty. Updates saturate: the closer a score is to +-HISTORY_MAX, the
+# less a bonus in that direction moves it, so scores never leave the range.
+#
+# Killers: the last two quiet cutoff moves of each ply, newest first.
+#
+# Both tables are fixed size and allocated once. new_search() ages them
+# between searches: history scores are halved, killers from the last
+# search (made at other plies of other positions) are dropped.
+
+HISTORY_MAX = 16384
+MAX_PLY = 128
+
+
+def _history_index(color, move):
+    return color << 12 | move.from_square << 6 | move.to_square
+
+
+class MoveOrdering:
+
+    def __init__(self):
+        self.history = array('i', bytes(4 * 2 * 64 * 64))
+        self.killers = array('H', bytes(2 * 2 * MAX_PLY))     # encoded moves, 0 is empty
+
+    @property
+    def memory_bytes(self):
+        return self.history.itemsize * len(self.history) + self.killers.itemsize * len(self.killers)
+
+    def clear(self):
+        self.history = array('i', bytes(4 * 2 * 64 * 64))
+        self.new_search()
+
+    def new_search(self):
+        self.history = array('i', [score // 2 for score in self.history])
+        self.killers = array('H', bytes(2 * 2 * MAX_PLY))
+
+    def history_score(self, color, move):
+        return self.history[_history_index(color, move)]
+
+    def killer_moves(self, ply):
+        # this ply's killers, newest first, None for an empty slot
+        if ply >= MAX_PLY:
+            return ()
+        return decode_move(self.killers[2 * ply]), decode_move(self.killers[2 * ply + 1])
+
+    def _update(self, index, bonus):
+        score = self.history[index]
+        self.history[index] = score + bonus - score * abs(bonus) // HISTORY_MAX
+
+    def cutoff(self, color, move, depth, ply, tried=()):
+        # quiet move caused a beta cutoff with depth left at ply, tried:
+        # the quiet moves searched before it
+        bonus = min(depth * depth, HISTORY_MAX)
+        self._update(_history_index(color, move), bonus)
+        for other in tried:
+            self._update(_history_index(color, other), -bonus)
+        if ply < MAX_PLY:
+            code = encode_move(move)
+            if self.killers[2 * ply] != code:
+                self.killers[2 * ply + 1] = self.killers[2 * ply]
+                self.killers[2 * ply] = code
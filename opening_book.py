@@ -0,0 +1,115 @@
+import random
+
+import numpy as np
+
+import chess
+
+from zobrist_hash import get_board_hash
+
+# In-memory opening book
+#
+# A polyglot book is a file of 16 byte big-endian entries sorted by
+# position key. The whole book is loaded once into a sorted numpy array in
+# native byte order, probes are a searchsorted over the key column with no
+# file access. The key is the polyglot zobrist key, the same one the
+# search computes with zobrist_hash.get_board_hash.
+#
+# save() writes the array as .npy. Opening a .npy memory maps it read-only,
+# so every process of the engine pool shares one copy through the page
+# cache instead of loading its own.
+
+# polyglot file layout
+POLYGLOT_DTYPE = np.dtype([('key', '>u8'), ('move', '>u2'), ('weight', '>u2'), ('learn', '>u4')])
+# in-memory layout
+ENTRY_DTYPE = np.dtype([('key', '<u8'), ('move', '<u2'), ('weight', '<u2'), ('learn', '<u4')])
+
+# polyglot stores castling as king takes own rook
+_CASTLING_TARGETS = {
+    (chess.E1, chess.H1): chess.G1, (chess.E1, chess.A1): chess.C1,
+    (chess.E8, chess.H8): chess.G8, (chess.E8, chess.A8): chess.C8,
+}
+
+
+def load_polyglot(path):
+    # entries of a polyglot .bin file as an ENTRY_DTYPE array
+    return np.fromfile(path, dtype=POLYGLOT_DTYPE).astype(ENTRY_DTYPE)
+
+
+def decode_polyglot_move(board, raw):
+    origin = (raw >> 6) & 0x3F
+    destination = raw & 0x3F
+    promotion = (raw >> 12) & 0x7
+    if (origin, destination) in _CASTLING_TARGETS and board.kings & chess.BB_SQUARES[origin]:
+        destination = _CASTLING_TARGETS[(origin, destination)]
+    return chess.Move(origin, destination, promotion + 1 if promotion else None)
+
+
+class Book:
+
+    def __init__(self, entries, min_weight=1):
+        # entries: ENTRY_DTYPE array sorted by key. Entries lighter than
+        # min_weight are dropped (polyglot readers skip weight 0 by default).
+        # Filtering copies, so entries that all pass, such as a memory
+        # mapped book saved already filtered, are used as they are.
+        if min_weight > 0 and len(entries) and entries['weight'].min() < min_weight:
+            entries = entries[entries['weight'] >= min_weight]
+        self.entries = entries
+        self.keys = entries['key']
+
+    @classmethod
+    def open(cls, path, min_weight=1):
+        # .npy files from save() are memory mapped, anything else is read
+        # as a polyglot book
+        if str(path).endswith(".npy"):
+            return cls(np.load(path, mmap_mode='r'), min_weight)
+        return cls(load_polyglot(path), min_weight)
+
+    @classmethod
+    def merge(cls, books, min_weight=1):
+        # One book from several, a (position, move) pair in more than one
+        # book keeps its heaviest weight
+        entries = np.concatenate([book.entries for book in books])
+        entries = entries[np.lexsort((-entries['weight'].astype(np.int32), entries['move'], entries['key']))]
+        first = np.ones(len(entries), dtype=bool)
+        first[1:] = (entries['key'][1:] != entries['key'][:-1]) | (entries['move'][1:] != entries['move'][:-1])
+        return cls(entries[first], min_weight)
+
+    def save(self, path):
+        # the entries left after min_weight, so opening the file with the
+        # same min_weight maps it without a copy
+        np.save(path, np.ascontiguousarray(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, key):
+        # entries stored for key, a view into the book
+        key = np.uint64(key)
+        start = np.searchsorted(self.keys, key, side='left')
+        if start == len(self.keys) or self.keys[start] != key:
+            return self.entries[0:0]
+        return self.entries[start:np.searchsorted(self.keys, key, side='right')]
+
+    def moves(self, board, key=None):
+        # [(move, weight)] of legal book moves for board
+        if key is None:
+            key = get_board_hash(board)
+        entries = self.find(key)
+        found = []
+        for raw, weight in zip(entries['move'].tolist(), entries['weight'].tolist()):
+            move = decode_polyglot_move(board, raw)
+            if board.is_legal(move):
+                found.append((move, weight))
+        return found
+
+    def weighted_choice(self, board, key=None, rng=random):
+        # a book move picked proportionally to its weight, or None
+        moves = self.moves(board, key)
+        if not moves:
+            return None
+        total = sum(weight for _, weight in moves)
+        pick = rng.randint(0, total - 1)
+        for move, weight in moves:
+            pick -= weight
+            if pick < 0:
+                return move
@@ -0,0 +1,215 @@
+import threading
+
+from evaluation import CP_PER_PAWN, mate_in
+
+# Search statistics
+#
+# SearchStats is a snapshot of one get_best_move call, built from the
+# counters chess_bot keeps while searching. SearchMetrics sums snapshots
+# over the life of a server and renders them in the Prometheus text format.
+
+
+def json_score(score):
+    # search scores are centipawns from white's view, reported in pawns,
+    # mates as "mate" / "-mate" (distance in mate_moves)
+    if score is None:
+        return None
+    if mate_in(score) is None:
+        return score / CP_PER_PAWN
+    return "mate" if score > 0 else "-mate"
+
+
+def line_dict(score, pv):
+    # one root move line (an entry of chess_bot.root_lines) as JSON
+    return {
+        'move': pv[0].uci(),
+        'score': json_score(score),
+        'mate_moves': mate_in(score),
+        'pv': [move.uci() for move in pv],
+    }
+
+
+def unscored_line(move):
+    # the line of a move played without a search score (book and cached
+    # moves, searches stopped before depth 1), move as UCI
+    return {'move': move, 'score': None, 'mate_moves': None, 'pv': [move]}
+
+
+def iteration_dict(depth, seconds, nodes, score, pv, lines=None):
+    # one completed iteration (chess_bot.on_iteration arguments) as JSON,
+    # seconds and nodes count from the start of the search. lines are the
+    # iteration's root move lines of a multipv search.
+    iteration = {
+        'depth': depth,
+        'score': json_score(score),
+        'mate_moves': mate_in(score),
+        'pv': [move.uci() for move in pv],
+        'nodes': nodes,
+        'time_s': round(seconds, 4),
+        'nps': round(nodes / seconds) if seconds else 0,
+    }
+    if lines is not None:
+        iteration['lines'] = [line_dict(*line) for line in lines]
+    return iteration
+
+
+class SearchStats:
+
+    def __init__(self, move=None, score=None, depth=0, nodes=0, qnodes=0, time_s=0.0,
+                 tt_probes=0, tt_hits=0, tt_cutoffs=0, beta_cutoffs=0, first_move_cutoffs=0,
+                 eval_probes=0, eval_hits=0, pawn_probes=0, pawn_hits=0,
+                 iterations=(), lines=(), profile=None, book=False):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.qnodes = qnodes
+        self.time_s = time_s
+        self.tt_probes = tt_probes
+        self.tt_hits = tt_hits
+        self.tt_cutoffs = tt_cutoffs                    # probes that ended the node
+        self.beta_cutoffs = beta_cutoffs
+        self.first_move_cutoffs = first_move_cutoffs    # cutoffs by the first ordered move
+        self.eval_probes = eval_probes                  # eval cache
+        self.eval_hits = eval_hits
+        self.pawn_probes = pawn_probes                  # pawn structure table
+        self.pawn_hits = pawn_hits
+        self.iterations = list(iterations)              # dicts with depth, time_s, nodes, score, pv
+        self.lines = list(lines)                        # (score, pv) per root move line, best first
+        self.profile = profile                          # seconds by part, when profiling
+        self.book = book
+
+    @property
+    def nps(self):
+        return self.nodes / self.time_s if self.time_s else 0.0
+
+    @property
+    def tt_hit_rate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    @property
+    def eval_hit_rate(self):
+        return self.eval_hits / self.eval_probes if self.eval_probes else 0.0
+
+    @property
+    def pawn_hit_rate(self):
+        return self.pawn_hits / self.pawn_probes if self.pawn_probes else 0.0
+
+    @property
+    def first_move_cutoff_rate(self):
+        # share of beta cutoffs found by the first move, move ordering quality
+        return self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0.0
+
+    @property
+    def branching_factor(self):
+        # effective branching factor, nodes of the last iteration over the
+        # nodes of the one before
+        nodes = [0] + [i['nodes'] for i in self.iterations]    # cumulative
+        if len(nodes) < 3:
+            return None
+        previous = nodes[-2] - nodes[-3]
+        return (nodes[-1] - nodes[-2]) / previous if previous else None
+
+    def line_dicts(self):
+        # every move comes with at least its own line, without a score
+        # when the move was not scored by a search
+        if self.lines:
+            return [line_dict(*line) for line in self.lines]
+        return [unscored_line(self.move.uci())] if self.move else []
+
+    def to_dict(self):
+        return {
+            'move': self.move.uci() if self.move else None,
+            'score': json_score(self.score),
+            'mate_moves': mate_in(self.score),
+            'depth': self.depth,
+            'book': self.book,
+            'nodes': self.nodes,
+            'qnodes': self.qnodes,
+            'time_s': round(self.time_s, 4),
+            'nps': round(self.nps),
+            'tt_probes': self.tt_probes,
+            'tt_hits': self.tt_hits,
+            'tt_cutoffs': self.tt_cutoffs,
+            'tt_hit_rate': round(self.tt_hit_rate, 4),
+            'beta_cutoffs': self.beta_cutoffs,
+            'first_move_cutoffs': self.first_move_cutoffs,
+            'first_move_cutoff_rate': round(self.first_move_cutoff_rate, 4),
+            'eval_probes': self.eval_probes,
+            'eval_hits': self.eval_hits,
+            'eval_hit_rate': round(self.eval_hit_rate, 4),
+            'pawn_probes': self.pawn_probes,
+            'pawn_hits': self.pawn_hits,
+            'pawn_hit_rate': round(self.pawn_hit_rate, 4),
+            'branching_factor': self.branching_factor and round(self.branching_factor, 2),
+            'iterations': [dict(i, score=json_score(i['score'])) for i in self.iterations],
+            'lines': self.line_dicts(),
+            'profile': self.profile,
+        }
+
+
+# counters summed by SearchMetrics: (metric name, stats key, help)
+_COUNTERS = [
+    ("chesser_search_nodes_total", "nodes", "Nodes searched"),
+    ("chesser_search_qnodes_total", "qnodes", "Quiescence nodes searched"),
+    ("chesser_search_seconds_total", "time_s", "Time spent searching"),
+    ("chesser_tt_probes_total", "tt_probes", "Transposition table probes"),
+    ("chesser_tt_hits_total", "tt_hits", "Transposition table hits"),
+    ("chesser_tt_cutoffs_total", "tt_cutoffs", "Nodes cut by a transposition table entry"),
+    ("chesser_beta_cutoffs_total", "beta_cutoffs", "Beta cutoffs"),
+    ("chesser_first_move_cutoffs_total", "first_move_cutoffs", "Beta cutoffs by the first move searched"),
+    ("chesser_eval_cache_probes_total", "eval_probes", "Evaluation cache probes"),
+    ("chesser_eval_cache_hits_total", "eval_hits", "Evaluation cache hits"),
+    ("chesser_pawn_table_probes_total", "pawn_probes", "Pawn structure table probes"),
+    ("chesser_pawn_table_hits_total", "pawn_hits", "Pawn structure table hits"),
+]
+
+
+class SearchMetrics:
+    # running totals over SearchStats.to_dict() results, thread safe
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.book_moves = 0
+        self.totals = {key: 0 for _, key, _ in _COUNTERS}
+        self.profile = {}
+        self.depths = {}
+
+    def observe(self, stats):
+        with self._lock:
+            if stats['book']:
+                self.book_moves += 1
+                return
+            self.searches += 1
+            for _, key, _ in _COUNTERS:
+                self.totals[key] += stats[key]
+            for part, seconds in (stats['profile'] or {}).items():
+                self.profile[part] = self.profile.get(part, 0.0) + seconds
+            self.depths[stats['depth']] = self.depths.get(stats['depth'], 0) + 1
+
+    def prometheus(self, extra=()):
+        # text exposition format, extra: more (name, type, value, help) metrics
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        with self._lock:
+            metric("chesser_searches_total", "counter", "Searches run",
+                   [("", self.searches)])
+            metric("chesser_book_moves_total", "counter", "Moves played from the opening book",
+                   [("", self.book_moves)])
+            for name, key, help in _COUNTERS:
+                metric(name, "counter", help, [("", self.totals[key])])
+            metric("chesser_search_depth_total", "counter", "Searches by completed depth",
+                   [(f'{{depth="{d}"}}', n) for d, n in sorted(self.depths.items())])
+            if self.profile:
+                metric("chesser_search_profile_seconds_total", "counter", "Profiled search time by part",
+                       [(f'{{part="{p}"}}', s) for p, s in sorted(self.profile.items())])
+        for name, kind, value, help in extra:
+            metric(name, kind, help, [("", value)])
+        return "\n".join(lines) + "\n"
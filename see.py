@@ -0,0 +1,61 @@
+import chess
+
+from evaluation import PIECE_VALUES
+
+# Static exchange evaluation
+#
+# Material won or lost by the side to move when move starts a capture
+# sequence on its target square: both sides recapture with their least
+# valuable attacker and either side may stop when going on would lose
+# material. Attackers are recomputed from the shrinking occupancy, so
+# sliders lined up behind a capturing piece (x-rays) join in. Pins are
+# ignored, a king only recaptures onto an undefended square.
+
+# least valuable attacker first
+_ATTACKER_ORDER = (chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN, chess.KING)
+
+
+def captured_value(board, move):
+    # material a capture or promotion wins outright
+    if board.is_en_passant(move):
+        value = PIECE_VALUES[chess.PAWN]
+    else:
+        value = PIECE_VALUES[board.piece_type_at(move.to_square) or 0]
+    if move.promotion:
+        value += PIECE_VALUES[move.promotion] - PIECE_VALUES[chess.PAWN]
+    return value
+
+
+def see(board, move):
+    to_square = move.to_square
+    piece_type = move.promotion or board.piece_type_at(move.from_square)
+    gains = [captured_value(board, move)]
+    occupied = board.occupied ^ chess.BB_SQUARES[move.from_square]
+    if board.is_en_passant(move):
+        occupied ^= chess.BB_SQUARES[to_square - 8 if board.turn else to_square + 8]
+    pieces = (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings)
+
+    color = not board.turn
+    while True:
+        attackers = board.attackers_mask(color, to_square, occupied) & occupied
+        if not attackers:
+            break
+        for attacker_type, bb in zip(_ATTACKER_ORDER, pieces):
+            found = attackers & bb
+            if found:
+                break
+        square = chess.lsb(found)
+        if attacker_type == chess.KING and (
+                board.attackers_mask(not color, to_square, occupied) & occupied & ~chess.BB_SQUARES[square]):
+            break
+        # value of the piece taken minus what the opponent gained before
+        gains.append(PIECE_VALUES[piece_type] - gains[-1])
+        piece_type = attacker_type
+        occupied ^= chess.BB_SQUARES[square]
+        color = not color
+
+    # either side stops the sequence as soon as going on would lose
+    while len(gains) > 1:
+        last = gains.pop()
+        gains[-1] = -max(-gains[-1], last)
+    return gains[0]
@@ -1,9 +1,85 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
+import io
+import json
+import os
+import uuid
 import chess
-from chess_bot import get_best_move, board_to_array  # import your functions
+from engine_pool import get_pool, EngineBusy
+from analysis_cache import AnalysisCache
+from game_session import GameSession, SessionStore
+from batch import BatchPool, read_positions
+from chess_bot import allocate_time
+from search_stats import unscored_line
+from zobrist_hash import get_board_hash
 
 app = Flask(__name__)
 
+# Searches run in CHESSER_ENGINES engine processes (see engine_pool.py), so
+# games don't block each other or share search state. At most
+# CHESSER_MAX_PENDING searches may be queued or running, more get a 503.
+ENGINES = int(os.environ.get("CHESSER_ENGINES", 2))
+MAX_PENDING = int(os.environ.get("CHESSER_MAX_PENDING", 64))
+
+# transposition tables survive between requests, "shared" across all games
+# of an engine or one per game ("game"), see chess_bot.configure_tables
+TT_MODE = os.environ.get("CHESSER_TT_MODE", "shared")
+TT_MB = int(os.environ.get("CHESSER_TT_MB", 16))
+# memory each engine may spend on per-game tables (game mode and game
+# sessions), the least recently used game's tables go first
+GAME_TABLES_MB = int(os.environ.get("CHESSER_GAME_TABLES_MB", 8 * TT_MB))
+
+# game sessions (/api/games): idle ones expire after CHESSER_SESSION_TTL_S,
+# the least recently used are evicted beyond CHESSER_MAX_SESSIONS
+SESSION_TTL_S = float(os.environ.get("CHESSER_SESSION_TTL_S", 30 * 60))
+MAX_SESSIONS = int(os.environ.get("CHESSER_MAX_SESSIONS", 1000))
+# most root move lines a search may rank, see multipv in /api/move
+MAX_MULTIPV = int(os.environ.get("CHESSER_MAX_MULTIPV", 10))
+
+# after replying in a session an idle engine ponders on the expected human
+# move for up to this long. Off by default: it spends engine time on every
+# reply, also in games that were abandoned.
+PONDER_MS = int(os.environ.get("CHESSER_PONDER_MS", 0))
+sessions = SessionStore(MAX_SESSIONS, SESSION_TTL_S)
+
+# upper bound on the time any single /api/move search may take
+MAX_MOVETIME_MS = int(os.environ.get("CHESSER_MAX_MOVETIME_MS", 10000))
+
+# processes per search, more than 1 runs a lazy SMP search (see smp.py)
+# over a table of CHESSER_TT_MB in shared memory
+SEARCH_WORKERS = int(os.environ.get("CHESSER_WORKERS", 1))
+
+# time evaluation, hashing, move generation and ordering in every search,
+# reported in the move stats and /metrics (costs some speed)
+PROFILE = os.environ.get("CHESSER_PROFILE", "0") == "1"
+
+# how long /api/move waits for a queued search before handing out the job
+# id to poll instead
+JOB_WAIT_S = float(os.environ.get("CHESSER_JOB_WAIT_S", 60))
+
+# seconds between keep-alive comments on an idle /api/job/<id>/events stream
+EVENTS_KEEPALIVE_S = float(os.environ.get("CHESSER_EVENTS_KEEPALIVE_S", 15))
+
+# finished searches by position, CHESSER_CACHE_SIZE 0 turns the cache off.
+# With CHESSER_CACHE_DB results are also kept in that SQLite file.
+CACHE_SIZE = int(os.environ.get("CHESSER_CACHE_SIZE", 10000))
+cache = AnalysisCache(CACHE_SIZE, float(os.environ.get("CHESSER_CACHE_TTL_S", 24 * 3600)),
+                      os.environ.get("CHESSER_CACHE_DB")) if CACHE_SIZE else None
+
+# processes for /api/analyze_batch, separate from the game engines
+BATCH_WORKERS = int(os.environ.get("CHESSER_BATCH_WORKERS", os.cpu_count() or 1))
+batch_pool = None
+
+def engines():
+    return get_pool(ENGINES, max_pending=MAX_PENDING, tt_mode=TT_MODE, tt_mb=TT_MB,
+                    max_games=max(1, GAME_TABLES_MB // TT_MB), search_workers=SEARCH_WORKERS, ponder_ms=PONDER_MS,
+                    profile=PROFILE)
+
+def batch_engines():
+    global batch_pool
+    if batch_pool is None:
+        batch_pool = BatchPool(BATCH_WORKERS)
+    return batch_pool
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -12,7 +88,8 @@ def index():
 def new_game():
     board = chess.Board()
     return jsonify({
-        'fen': board.fen()
+        'fen': board.fen(),
+        'game_id': uuid.uuid4().hex   # lets the engine keep per-game search state
     })
 
 @app.route('/api/move', methods=['POST'])
@@ -20,21 +97,306 @@ def make_move():
     data = request.get_json()
     fen = data['fen']              # current position in FEN
     move_uci = data.get('move')    # human's UCI string, e.g. "e2e4", or None if AI to play
-    depth = data.get('depth', 3)   # AI lookahead depth, default to 3
-    board = chess.Board(fen)
+    game_id = data.get('game_id')  # from /api/new_game, optional
 
-    # Apply human move if provided
+    # Check the limits and the human move here, the engine only gets legal
+    # positions with moves left
+    try:
+        depth, movetime_ms, clock_ms, increment_ms = search_limits(data)
+        multipv = search_multipv(data)
+        board = chess.Board(fen)
+        if move_uci and chess.Move.from_uci(move_uci) not in board.legal_moves:
+            raise ValueError(f"illegal move {move_uci}")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     if move_uci:
         board.push_uci(move_uci)
+    if board.is_game_over():
+        return jsonify({'move': None, 'fen': board.fen(), 'result': board.result(), 'job_id': None,
+                        'cached': False, 'lines': [], 'stats': None})
 
-    # Let the AI pick its move with specified depth
-    ai_move = get_best_move(board, depth)    # returns a chess.Move
-    board.push(ai_move)
+    # Answer from the cache when a deep enough (or long enough) search of
+    # this position was done before, the cache keeps no ranked lines
+    if cache is not None and multipv == 1:
+        cached = cache.get(get_board_hash(board), depth, search_budget_ms(depth, movetime_ms, clock_ms, increment_ms))
+        if cached:
+            board.push_uci(cached)
+            # same shape as a search's response, the cache keeps no score,
+            # PV or stats
+            return jsonify({'move': cached, 'fen': board.fen(), 'job_id': None, 'cached': True,
+                            'lines': [unscored_line(cached)], 'stats': None})
 
-    return jsonify({
-        'move': ai_move.uci(),         # e.g. "g8f6"
-        'fen': board.fen()             # new position
-    })
+    # Let the AI pick its move within the depth / time limits
+    try:
+        job = engines().submit(fen, move_uci, game_id=game_id, depth=depth, movetime_ms=movetime_ms,
+                               clock_ms=clock_ms, increment_ms=increment_ms, multipv=multipv)
+    except EngineBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+
+    # wait=false returns at once, the client polls /api/job/<job_id> or
+    # follows /api/job/<job_id>/events
+    if not data.get('wait', True) or not job.wait(JOB_WAIT_S):
+        return jsonify(job.status()), 202
+    return job_response(job)
+
+@app.route('/api/games', methods=['POST'])
+def create_game():
+    # Starts a game session (see game_session.py) from fen, by default the
+    # starting position. The server keeps the board, its history and the
+    # engine's tables for the game, moves go to /api/games/<game_id>/move.
+    data = request.get_json(silent=True) or {}
+    try:
+        session = GameSession(uuid.uuid4().hex, data.get('fen', chess.STARTING_FEN))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    end_sessions(sessions.add(session))
+    return jsonify(session_state(session)), 201
+
+@app.route('/api/games/<game_id>', methods=['GET'])
+def get_game(game_id):
+    session = find_session(game_id)
+    if session is None:
+        return jsonify({'error': 'unknown or expired game'}), 404
+    return jsonify(session_state(session))
+
+@app.route('/api/games/<game_id>', methods=['DELETE'])
+def end_game(game_id):
+    session = sessions.remove(game_id)
+    if session is None:
+        return jsonify({'error': 'unknown or expired game'}), 404
+    if session.job_id is not None:
+        engines().stop(session.job_id)
+    end_sessions([game_id])
+    return '', 204
+
+@app.route('/api/games/<game_id>/move', methods=['POST'])
+def game_move(game_id):
+    # Plays the human move (UCI, optional) in the session and asks the
+    # engine for its reply, which joins the session once the search is
+    # done. Limits, wait and responses as for /api/move, 409 while the
+    # engine is still thinking about the last move.
+    data = request.get_json(silent=True) or {}
+    session = find_session(game_id)
+    if session is None:
+        return jsonify({'error': 'unknown or expired game'}), 404
+    try:
+        depth, movetime_ms, clock_ms, increment_ms = search_limits(data)
+        multipv = search_multipv(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    with session.lock:
+        if session.job_id is not None:
+            return jsonify({'error': 'engine is still thinking', 'job_id': session.job_id}), 409
+        move_uci = data.get('move')
+        if move_uci:
+            try:
+                move = chess.Move.from_uci(move_uci)
+                if move not in session.board.legal_moves:
+                    raise ValueError(f"illegal move {move_uci}")
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            session.push(move)
+        if session.board.is_game_over():
+            return jsonify(dict(session_state(session), move=None, result=session.board.result()))
+        try:
+            job = engines().submit(session.fen, game_id=game_id, session=(session.start_fen, list(session.moves)),
+                                   depth=depth, movetime_ms=movetime_ms, clock_ms=clock_ms,
+                                   increment_ms=increment_ms, multipv=multipv)
+        except EngineBusy as e:
+            # take the human move back, the client sends it again
+            if move_uci:
+                session.pop()
+            return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+        session.job_id = job.id
+
+    if not data.get('wait', True) or not job.wait(JOB_WAIT_S):
+        return jsonify(job.status()), 202
+    return job_response(job)
+
+@app.route('/api/job/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = engines().get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    if not job.done:
+        return jsonify(job.status()), 202
+    return job_response(job)
+
+@app.route('/api/job/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    # Server-Sent Events: an "iteration" event for every completed iterative
+    # deepening iteration (depth, score, pv, nodes, nps), then "done" with
+    # the /api/job/<job_id> response or "failed" with the error
+    job = engines().get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+
+    def events():
+        seen = 0
+        while True:
+            job.wait_progress(seen, EVENTS_KEEPALIVE_S)
+            done = job.done
+            iterations = job.iterations[seen:]
+            for iteration in iterations:
+                yield server_event('iteration', iteration)
+            seen += len(iterations)
+            if done:
+                body, status = job_result(job)
+                yield server_event('done' if status == 200 else 'failed', body)
+                return
+            if not iterations:
+                yield ': keep-alive\n\n'
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/job/<job_id>/stop', methods=['POST'])
+def stop_job(job_id):
+    # the job's search returns its best move so far, the result arrives as
+    # usual through /api/job/<job_id> or the event stream
+    pool = engines()
+    if pool.stop(job_id):
+        return jsonify({'job_id': job_id, 'status': 'stopping'}), 202
+    job = pool.get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return job_response(job)
+
+@app.route('/api/analyze_batch', methods=['POST'])
+def analyze_batch():
+    # Positions as JSON {"positions": [fen, ...]} or as an EPD/FEN or PGN
+    # text body (?format=pgn), streamed back as JSON lines in input order.
+    # Limits come from the JSON body or the query string: depth (default 3)
+    # and/or movetime_ms, capped at MAX_MOVETIME_MS.
+    if request.is_json:
+        data = request.get_json()
+        positions = ((str(i), fen) for i, fen in enumerate(data['positions'], start=1))
+    else:
+        data = {key: int(request.args[key]) for key in ('depth', 'movetime_ms') if key in request.args}
+        text = io.TextIOWrapper(request.stream, encoding='utf-8')
+        positions = read_positions(text, request.args.get('format', 'epd'))
+    movetime_ms = data.get('movetime_ms')
+    depth = data.get('depth', None if movetime_ms else 3)
+    movetime_ms = min(movetime_ms or MAX_MOVETIME_MS, MAX_MOVETIME_MS)
+
+    def lines():
+        for result in batch_engines().analyze(positions, depth, movetime_ms):
+            yield json.dumps(result) + '\n'
+    return Response(lines(), mimetype='application/x-ndjson')
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus text format
+    pool = engines()
+    extra = [("chesser_pending_searches", "gauge", sum(pool.pending), "Searches queued or running")]
+    if cache is not None:
+        stats = cache.stats()
+        extra += [("chesser_cache_hits_total", "counter", stats['hits'], "Analysis cache hits"),
+                  ("chesser_cache_misses_total", "counter", stats['misses'], "Analysis cache misses"),
+                  ("chesser_cache_entries", "gauge", stats['entries'], "Analysis cache entries")]
+    return Response(pool.metrics.prometheus(extra), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(cache.stats() if cache is not None else {})
+
+def search_limits(data):
+    # Time control: movetime_ms, or the engine's remaining clock_ms plus
+    # increment_ms. Without one, the search is depth limited (default 3).
+    # Either way it never runs longer than MAX_MOVETIME_MS.
+    # Returns (depth, movetime_ms, clock_ms, increment_ms), raises
+    # ValueError for limits that are not positive integers.
+    for key in ('depth', 'movetime_ms', 'clock_ms', 'increment_ms'):
+        value = data.get(key)
+        minimum = 0 if key == 'increment_ms' else 1
+        if value is not None and (type(value) is not int or value < minimum):
+            raise ValueError(f"{key} must be an integer of at least {minimum}")
+    movetime_ms = data.get('movetime_ms')
+    clock_ms = data.get('clock_ms')
+    increment_ms = data.get('increment_ms', 0)
+    timed = movetime_ms is not None or clock_ms is not None
+    depth = data.get('depth', None if timed else 3)
+    movetime_ms = min(movetime_ms or MAX_MOVETIME_MS, MAX_MOVETIME_MS)
+    return depth, movetime_ms, clock_ms, increment_ms
+
+def search_multipv(data):
+    # multipv N ranks the N best moves of the position searched, each with
+    # its score and PV ('lines' in the response), in one search. Capped at
+    # MAX_MULTIPV, 1 searches for the best move only.
+    multipv = data.get('multipv', 1)
+    if type(multipv) is not int or multipv < 1:
+        raise ValueError("multipv must be an integer of at least 1")
+    return min(multipv, MAX_MULTIPV)
+
+def search_budget_ms(depth, movetime_ms, clock_ms, increment_ms):
+    # time a depth-unlimited search gets, None for depth limited searches
+    if depth is not None:
+        return None
+    return allocate_time(movetime_ms, clock_ms, increment_ms) * 1000
+
+def server_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def job_response(job):
+    body, status = job_result(job)
+    return jsonify(body), status
+
+def session_state(session):
+    return {'game_id': session.game_id, 'fen': session.fen, 'moves': session.moves, 'job_id': session.job_id}
+
+def find_session(game_id):
+    # the session with the engine move of a finished search played, None
+    # when unknown or expired
+    end_sessions(sessions.expire())
+    session = sessions.get(game_id)
+    if session is not None and session.job_id is not None:
+        job = engines().get(session.job_id)
+        if job is None or job.done:
+            finish_session_job(session, job)
+    return session
+
+def finish_session_job(session, job):
+    # play the engine's move of job in session, once
+    with session.lock:
+        if job is not None and session.job_id != job.id:
+            return
+        session.job_id = None
+        if job is not None and job.error is None:
+            session.push(chess.Move.from_uci(job.result['move']))
+
+def end_sessions(game_ids):
+    # free what the engines keep for sessions that ended
+    for game_id in game_ids:
+        engines().end_game(game_id)
+
+def job_result(job):
+    # (response body, status) of a finished job
+    if job.session is not None:
+        session = sessions.get(job.params['game_id'])
+        if session is not None:
+            finish_session_job(session, job)
+    if job.error is not None:
+        return job.status(), 500
+    # book moves (depth 0) are picked at random and not cached, session
+    # moves depend on the game's history and stopped searches got less
+    # than the budget they would be cached with
+    if (cache is not None and job.result['depth'] and job.session is None and job.params['multipv'] == 1
+            and not job.stop_requested):
+        board = chess.Board(job.fen)
+        if job.human_move:
+            board.push_uci(job.human_move)
+        params = job.params
+        cache.put(get_board_hash(board), job.result['move'], job.result['depth'],
+                  search_budget_ms(params['depth'], params['movetime_ms'], params['clock_ms'],
+                                   params['increment_ms']))
+    return {
+        'move': job.result['move'],     # e.g. "g8f6"
+        'fen': job.result['fen'],       # new position
+        'job_id': job.id,
+        'cached': False,
+        'lines': job.result['stats']['lines'],  # best first, one per multipv line
+        'stats': job.result['stats']    # see search_stats.SearchStats
+    }, 200
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,151 @@
+import atexit
+import multiprocessing as mp
+import queue
+import traceback
+from multiprocessing import shared_memory
+
+import chess
+
+import chess_bot
+from transposition import TranspositionTable, TT_SIZE_MB, table_bytes
+
+# Lazy SMP
+#
+# N - 1 helper processes search the same root as the main process. They
+# don't split the tree, they only share one transposition table placed in
+# shared memory, so each process finds cutoffs and best moves the others
+# stored. Odd helpers aim one ply deeper and helpers rotate their root
+# move order to diverge further. The main process returns the deepest
+# completed result. Table entries are xor-verified, so no locks are taken.
+
+HELPER_POLL_S = 1.0     # seconds between checks on helpers that owe a result
+
+_pools = {}
+
+
+def _worker_main(index, shm_name, size_mb, tasks, results, stop_event):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    table = TranspositionTable(size_mb, shm.buf)
+    chess_bot.helper_id = index
+    chess_bot.stop_event = stop_event
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            root_fen, moves, depth, budget, generation = task
+            board = chess.Board(root_fen)
+            for uci in moves:
+                board.push_uci(uci)
+            try:
+                move = chess_bot.search(board, depth, budget, table, generation)
+            except Exception:
+                # the main process still waits for one result per helper,
+                # the helper stays up for the next search
+                traceback.print_exc()
+                results.put((index, 0, None, 0, 0))
+                continue
+            results.put((index, chess_bot.completed_depth, move.uci() if move else None,
+                         chess_bot.last_score, chess_bot.node_count))
+    finally:
+        chess_bot.tt = chess_bot.shared_tt
+        table.release()
+        shm.close()
+
+
+class SmpPool:
+    # long-lived helper processes and the shared table they search in
+
+    def __init__(self, workers, size_mb=TT_SIZE_MB):
+        ctx = mp.get_context("spawn")
+        self.workers = workers
+        self.size_mb = size_mb
+        self.shm = shared_memory.SharedMemory(create=True, size=table_bytes(size_mb))
+        self.table = TranspositionTable(size_mb, self.shm.buf)
+        self.table.clear()
+        self.stop_event = ctx.Event()
+        self.results = ctx.Queue()
+        self.tasks = []
+        self.processes = []
+        for index in range(1, workers):
+            tasks = ctx.Queue()
+            process = ctx.Process(target=_worker_main, daemon=True,
+                                  args=(index, self.shm.name, size_mb, tasks, self.results, self.stop_event))
+            process.start()
+            self.tasks.append(tasks)
+            self.processes.append(process)
+
+    def search(self, board, depth, budget, multipv=1):
+        generation = self.table.generation + 1
+        root = board.root()
+        moves = [move.uci() for move in board.move_stack]
+        self.stop_event.clear()
+        waiting = set()     # helpers whose result is still due
+        for index, (tasks, process) in enumerate(zip(self.tasks, self.processes), start=1):
+            if process.is_alive():
+                tasks.put((root.fen(), moves, depth + (index & 1), budget, generation))
+                waiting.add(index)
+
+        chess_bot.helper_id = 0
+        move = chess_bot.search(board, depth, budget, self.table, generation, multipv=multipv)
+        best = (chess_bot.completed_depth, move, chess_bot.last_score)
+        nodes = chess_bot.node_count
+
+        # stop the helpers and take the deepest completed iteration, the
+        # main process wins ties. Helpers search a single line, a multipv
+        # result is always the main process's.
+        self.stop_event.set()
+        while waiting:
+            try:
+                index, helper_depth, uci, score, helper_nodes = self.results.get(timeout=HELPER_POLL_S)
+            except queue.Empty:
+                # a helper that died (or never started) won't answer
+                waiting = {index for index in waiting if self.processes[index - 1].is_alive()}
+                continue
+            waiting.discard(index)
+            nodes += helper_nodes
+            if uci is not None and helper_depth > best[0] and multipv == 1:
+                best = (helper_depth, chess.Move.from_uci(uci), score)
+        chess_bot.completed_depth, move, chess_bot.last_score = best
+        chess_bot.node_count = nodes
+        stats = chess_bot.last_stats
+        stats.move, stats.depth, stats.score, stats.nodes = move, best[0], best[2], nodes
+        return move
+
+    @property
+    def healthy(self):
+        return all(process.is_alive() for process in self.processes)
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        chess_bot.tt = chess_bot.shared_tt
+        self.table.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+def get_pool(workers, size_mb=TT_SIZE_MB):
+    # the pool for workers and size_mb, started again when a helper died
+    pool = _pools.get((workers, size_mb))
+    if pool is not None and not pool.healthy:
+        del _pools[(workers, size_mb)]
+        pool.close()
+        pool = None
+    if pool is None:
+        pool = _pools[(workers, size_mb)] = SmpPool(workers, size_mb)
+    return pool
+
+
+def parallel_best_move(board, depth, budget, workers, size_mb=None, multipv=1):
+    return get_pool(workers, size_mb or chess_bot.shared_tt.size_mb).search(board, depth, budget, multipv)
+
+
+@atexit.register
+def close_pools():
+    while _pools:
+        _pools.popitem()[1].close()
@@ -4,6 +4,8 @@ $(function () {
   let possibleMoves = [];
   let botLastMove = null;
   let isThinking = false;
+  let gameId = null;
+  let currentJob = null; // { id, events } of the engine search being followed
 
   const board = Chessboard('board', {
     draggable: true,
@@ -35,6 +37,22 @@ $(function () {
   function hideThinkingIndicator() {
     isThinking = false;
     $('#thinking-indicator').addClass('hidden');
+    $('#search-progress').text('');
+  }
+
+  // Score of a search iteration from white's view, in pawns or moves to mate
+  function formatScore(iteration) {
+    if (iteration.mate_moves !== null) {
+      return `#${iteration.mate_moves}`;
+    }
+    return (iteration.score > 0 ? '+' : '') + iteration.score.toFixed(2);
+  }
+
+  // Show the latest completed search iteration under the board
+  function showProgress(iteration) {
+    $('#search-progress').text(
+      `depth ${iteration.depth} · ${formatScore(iteration)} · ${iteration.pv.join(' ')} · ` +
+      `${Math.round(iteration.nps / 1000)}k nodes/s`);
   }
 
   // Highlight bot's last move
@@ -53,12 +71,14 @@ $(function () {
 
   // New game function
   function startNewGame() {
+    abandonSearch();
     clearMoveIndicators();
     clearBotMoveHighlights();
     hideThinkingIndicator();
     $.getJSON('/api/new_game', data => {
       game.load(data.fen);
       board.position(data.fen);
+      gameId = data.game_id;
     });
   }
 
@@ -68,6 +88,16 @@ $(function () {
   // New game button handler
   $('#new-game-btn').click(startNewGame);
 
+  // Move now: the engine plays the best move of its last completed iteration
+  $('#stop-search-btn').click(() => {
+    if (currentJob) {
+      $.post(`/api/job/${currentJob.id}/stop`);
+    }
+  });
+
+  // Leaving the page stops the search instead of letting it run on the server
+  $(window).on('pagehide', abandonSearch);
+
   // Handle piece selection and move highlighting
   function onDragStart(source, piece, position, orientation) {
     // Only allow moves for the current player
@@ -188,34 +218,94 @@ $(function () {
       contentType: 'application/json',
       data: JSON.stringify({
         fen: game.fen(),
-        depth: getCurrentDepth()
+        depth: getCurrentDepth(),
+        game_id: gameId,
+        wait: false
       }),
       success: resp => {
-        // Store the history before applying the move
-        const historyBefore = game.history({ verbose: true });
-
-        // Apply the engine's move and redraw
-        game.load(resp.fen);
-        board.position(resp.fen);
-        clearMoveIndicators(); // Clear any remaining indicators
-
-        // Get the history after applying the move to find the bot's move
-        const historyAfter = game.history({ verbose: true });
-        if (historyAfter.length > historyBefore.length) {
-          const botMove = historyAfter[historyAfter.length - 1];
-          highlightBotMove(botMove.from, botMove.to);
+        // The game was left while the request was on its way
+        if (!isThinking) {
+          if (!resp.move && resp.job_id) navigator.sendBeacon(`/api/job/${resp.job_id}/stop`);
+          return;
+        }
+        // Cached moves come back at once, searches as a job to follow,
+        // and a game that is over comes back without either
+        if (resp.move) {
+          applyEngineMove(resp);
+        } else if (resp.job_id) {
+          followJob(resp.job_id);
+        } else {
+          hideThinkingIndicator();
         }
-
-        hideThinkingIndicator();
       },
-      error: () => {
-        // if something went wrong, just snap back to the current FEN
-        board.position(game.fen());
-        hideThinkingIndicator();
-      }
+      error: engineFailed
     });
   }
 
+  // Follow a search through its event stream: every completed iteration
+  // updates the progress line, the move arrives with the "done" event
+  function followJob(jobId) {
+    const events = new EventSource(`/api/job/${jobId}/events`);
+    currentJob = { id: jobId, events };
+    events.addEventListener('iteration', e => showProgress(JSON.parse(e.data)));
+    events.addEventListener('done', e => {
+      closeJob();
+      applyEngineMove(JSON.parse(e.data));
+    });
+    events.addEventListener('failed', () => {
+      closeJob();
+      engineFailed();
+    });
+    events.onerror = () => {
+      // the browser reconnects by itself unless the stream is gone for good
+      if (events.readyState === EventSource.CLOSED) {
+        closeJob();
+        engineFailed();
+      }
+    };
+  }
+
+  function closeJob() {
+    if (currentJob) {
+      currentJob.events.close();
+      currentJob = null;
+    }
+  }
+
+  // Stop following the running search and tell the server to stop it
+  function abandonSearch() {
+    if (currentJob) {
+      navigator.sendBeacon(`/api/job/${currentJob.id}/stop`);
+      closeJob();
+    }
+    hideThinkingIndicator();
+  }
+
+  function applyEngineMove(resp) {
+    // Store the history before applying the move
+    const historyBefore = game.history({ verbose: true });
+
+    // Apply the engine's move and redraw
+    game.load(resp.fen);
+    board.position(resp.fen);
+    clearMoveIndicators(); // Clear any remaining indicators
+
+    // Get the history after applying the move to find the bot's move
+    const historyAfter = game.history({ verbose: true });
+    if (historyAfter.length > historyBefore.length) {
+      const botMove = historyAfter[historyAfter.length - 1];
+      highlightBotMove(botMove.from, botMove.to);
+    }
+
+    hideThinkingIndicator();
+  }
+
+  function engineFailed() {
+    // if something went wrong, just snap back to the current FEN
+    board.position(game.fen());
+    hideThinkingIndicator();
+  }
+
   function onDrop(source, target) {
     // 1) Try the move locally
     const move = game.move({
@@ -0,0 +1,171 @@
+import chess
+
+# transposition table entry flags
+TT_EXACT = 0
+TT_LOWERBOUND = 1
+TT_UPPERBOUND = 2
+
+# default table size
+TT_SIZE_MB = 16
+
+# Entry layout, one slot per index in two parallel views of one buffer:
+#   checks 'Q'  zobrist key ^ data, verified on probe
+#   data   'Q'  packed move | flag << 16 | (depth + 1) << 18 | generation << 26
+#               | (score + SCORE_OFFSET) << 32
+# Scores are integer centipawns (mate scores included) and must fit in 16
+# bits. Depth is stored offset by one so a zero data word always means empty.
+# Storing the key xored with the rest of the entry makes the table safe to
+# share between processes without locks: an entry torn by a concurrent
+# write no longer verifies and reads as a miss.
+_ENTRY_BYTES = 8 + 8
+_FLAG_SHIFT = 16
+_DEPTH_SHIFT = 18
+_GENERATION_SHIFT = 26
+_MOVE_MASK = 0xFFFF
+_FLAG_MASK = 0x3
+_DEPTH_MASK = 0xFF
+_GENERATION_MASK = 0x3F
+_SCORE_SHIFT = 32
+_SCORE_OFFSET = 1 << 15
+
+# packed move -> chess.Move, filled lazily
+_decoded_moves = {0: None}
+
+
+def encode_move(move):
+    # from | to << 6 | promotion << 12, 0 is "no move" (a1a1 is never legal)
+    if move is None:
+        return 0
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code):
+    move = _decoded_moves.get(code)
+    if move is None and code:
+        move = chess.Move(code & 0x3F, (code >> 6) & 0x3F, (code >> 12) or None)
+        _decoded_moves[code] = move
+    return move
+
+
+class TranspositionTable:
+    # Fixed-size hash table of two-slot buckets. Slot 0 of each bucket is
+    # depth-preferred, slot 1 is always-replace. Memory is allocated once
+    # up front and never grows.
+    #
+    # The table is meant to outlive a single search: call new_search() at
+    # every root instead of clear(). Entries remember the generation they
+    # were written in, and entries from earlier searches lose their slot to
+    # new ones regardless of depth.
+
+    def __init__(self, size_mb=TT_SIZE_MB, buffer=None):
+        # buffer: optional writable buffer of table_bytes(size_mb) bytes,
+        # e.g. a multiprocessing.shared_memory block shared with other
+        # processes. A private one is allocated otherwise.
+        self.size_mb = size_mb
+        self.buckets = _bucket_count(size_mb)
+        self.slots = self.buckets * 2
+        self.probes = 0
+        self.hits = 0
+        self.generation = 0
+        self.used = 0
+        if buffer is None:
+            buffer = bytearray(self.memory_bytes)
+        view = memoryview(buffer)[:self.memory_bytes]
+        self.checks = view[:8 * self.slots].cast('Q')
+        self.data = view[8 * self.slots:].cast('Q')
+        self._view = view
+
+    def clear(self):
+        self._view[:] = bytes(self.memory_bytes)
+        self.used = 0
+        self.probes = 0
+        self.hits = 0
+        self.generation = 0
+
+    def new_search(self, generation=None):
+        # Age every stored entry by one generation and reset the per-search
+        # counters. Processes sharing a buffer pass the same generation.
+        if generation is None:
+            generation = self.generation + 1
+        self.generation = generation & _GENERATION_MASK
+        self.probes = 0
+        self.hits = 0
+
+    def release(self):
+        # let go of the buffer, needed before closing a shared memory block
+        for view in (self.checks, self.data, self._view):
+            view.release()
+
+    def __len__(self):
+        return self.used
+
+    @property
+    def memory_bytes(self):
+        return _ENTRY_BYTES * self.slots
+
+    def _find(self, key):
+        # the verified data word of key's entry, 0 when there is none. Each
+        # slot is read once: another process may rewrite it at any time, so
+        # the word that passed the check is the one to decode.
+        index = (key % self.buckets) << 1
+        check, word = self.checks[index], self.data[index]
+        if check ^ word == key and word:
+            return word
+        check, word = self.checks[index + 1], self.data[index + 1]
+        if check ^ word == key and word:
+            return word
+        return 0
+
+    def probe(self, key):
+        # (score, depth, flag, move) for key, or None
+        self.probes += 1
+        data = self._find(key)
+        if not data:
+            return None
+        self.hits += 1
+        return ((data >> _SCORE_SHIFT) - _SCORE_OFFSET, ((data >> _DEPTH_SHIFT) & _DEPTH_MASK) - 1,
+                (data >> _FLAG_SHIFT) & _FLAG_MASK, decode_move(data & _MOVE_MASK))
+
+    def get_move(self, key):
+        data = self._find(key)
+        if not data:
+            return None
+        return decode_move(data & _MOVE_MASK)
+
+    def store(self, key, score, depth, flag, move):
+        index = (key % self.buckets) << 1
+        checks = self.checks
+        data = self.data
+
+        # Depth-preferred slot takes the entry if it is empty, holds the same
+        # position, is left over from an earlier search or was searched no
+        # deeper. Otherwise the always-replace slot does.
+        old = data[index]
+        same = checks[index] ^ old == key
+        if (old and not same
+                and ((old >> _GENERATION_SHIFT) & _GENERATION_MASK) == self.generation
+                and ((old >> _DEPTH_SHIFT) & _DEPTH_MASK) - 1 > depth):
+            index += 1
+            old = data[index]
+            same = checks[index] ^ old == key
+
+        # keep the known best move when the new entry has none
+        code = encode_move(move)
+        if not code and same:
+            code = old & _MOVE_MASK
+        if not old:
+            self.used += 1
+
+        word = (code | (flag << _FLAG_SHIFT) | ((min(depth, _DEPTH_MASK - 1) + 1) << _DEPTH_SHIFT)
+                | (self.generation << _GENERATION_SHIFT) | ((score + _SCORE_OFFSET) << _SCORE_SHIFT))
+        data[index] = word
+        checks[index] = key ^ word
+
+
+def _bucket_count(size_mb):
+    return max(1, int(size_mb * 1024 * 1024) // (2 * _ENTRY_BYTES))
+
+
+def table_bytes(size_mb):
+    # bytes a table of size_mb needs, for allocating shared buffers
+    return _bucket_count(size_mb) * 2 * _ENTRY_BYTES
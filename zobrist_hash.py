@@ -1,231 +1,169 @@
-import math
-import pygame
-import sys
-import os
-import chess
-import numpy as np
-import chess.polyglot
 import random
 
-np.random.seed(718)
+import chess
+import chess.polyglot
 
 NUM_SQUARES = 64
 NUM_PIECE_TYPES = 6
 
-# zorbist hash
-# pawn, knight, bishop, rook, queen, king
-# positions go a1, b1, ..., g8, h8
-# access white pawn c1 = white_pieces[3]
-white_pieces = np.random.randint(0, 2**64, NUM_PIECE_TYPES * NUM_SQUARES, dtype=np.uint64)
-black_pieces = np.random.randint(0, 2**64, NUM_PIECE_TYPES * NUM_SQUARES, dtype=np.uint64)
+# zobrist hash
+# Keys are plain python ints taken from the polyglot random array, so
+# get_board_hash(board) == chess.polyglot.zobrist_hash(board) and the same
+# key can be used to probe the opening book.
+_RANDOM = chess.polyglot.POLYGLOT_RANDOM_ARRAY
 
-# indicates castling rights
-# left castle is index 1
-white_castle = np.random.randint(0, 2**64, 2, dtype=np.uint64)
-black_castle = np.random.randint(0, 2**64, 2, dtype=np.uint64)
+# flat piece/square table, access PIECE_KEYS[piece_index(color, type) * 64 + square]
+# piece index follows polyglot: black pawn 0, white pawn 1, black knight 2, ...
+PIECE_KEYS = _RANDOM[:2 * NUM_PIECE_TYPES * NUM_SQUARES]
 
-# blacks turn
-black_turn = np.random.randint(0, 2**64, 1, dtype=np.uint64).item()
+# castling rights keyed by the rook's home square
+CASTLING_KEYS = {
+    chess.H1: _RANDOM[768],
+    chess.A1: _RANDOM[769],
+    chess.H8: _RANDOM[770],
+    chess.A8: _RANDOM[771],
+}
 
-# en passant active, access by row
-en_passant = np.random.randint(0, 2**64, 8, dtype=np.uint64)
+# en passant, access by file
+EN_PASSANT_KEYS = _RANDOM[772:780]
 
+# toggled on every move, present while white is to move
+TURN_KEY = _RANDOM[780]
 
-def get_board_hash(board):
-    hash = np.uint64(0)
-
-    if board.turn == chess.BLACK:
-        hash = np.bitwise_xor(hash, black_turn)
-
-    if board.has_kingside_castling_rights(chess.WHITE):
-        hash = np.bitwise_xor(hash, white_castle[1])
-    if board.has_queenside_castling_rights(chess.WHITE):
-        hash = np.bitwise_xor(hash, white_castle[0])
-    if board.has_kingside_castling_rights(chess.BLACK):
-        hash = np.bitwise_xor(hash, black_castle[1])
-    if board.has_queenside_castling_rights(chess.BLACK):
-        hash = np.bitwise_xor(hash, black_castle[0])
-
-    for i in range(8):
-        for j in range(8):
-            # board.piece_at
-            square = chess.square(j, i)
-            piece = board.piece_at(square)
-
-            if piece == None:
-                continue
-
-            piece_hash = get_piece_hash(piece, square)
-
-            hash = np.bitwise_xor(hash, piece_hash)
-    
-    if board.ep_square is not None:
-        file = chess.square_file(board.ep_square)
-        hash = np.bitwise_xor(hash, en_passant[file])
-    
-    return hash
+_BACK_RANK = {chess.WHITE: chess.BB_RANK_1, chess.BLACK: chess.BB_RANK_8}
 
-def process_move(hash, board, move):
-    origin = move.from_square
-    destination = move.to_square
-    piece = board.piece_at(origin)
-    origin_hash = get_piece_hash(piece, origin)
-    destination_hash = get_piece_hash(piece, destination)
 
-    white_move = False
-    if board.turn == chess.WHITE:
-        white_move = True
+def piece_index(color, piece_type):
+    return (piece_type - 1) * 2 + int(color)
 
-    if board.is_en_passant(move):
-        # dehash captured pawn
-        if white_move:
-            en_passant_square = destination - 8
-        else:
-            en_passant_square = destination + 8
 
-        en_passant_captured = board.piece_at(en_passant_square)
-        en_passant_hash = get_piece_hash(en_passant_captured, en_passant_square)
+def get_piece_hash(piece, square_index):
+    if piece == None:
+        return None
+    return PIECE_KEYS[piece_index(piece.color, piece.piece_type) * NUM_SQUARES + square_index]
 
-        hash = np.bitwise_xor(hash, en_passant_hash)
 
-    elif board.is_capture(move):
-        # dehash the captured piece
-        captured = board.piece_at(destination)
+def _ep_capturable(board, ep_square, color):
+    # can a pawn of color pseudo-legally capture on ep_square
+    return bool(chess.BB_PAWN_ATTACKS[not color][ep_square] & board.pawns & board.occupied_co[color])
 
-        captured_hash = get_piece_hash(captured, destination)
 
-        hash = np.bitwise_xor(hash, captured_hash)
-    elif board.is_castling(move):
-        if board.is_kingside_castling(move):
-            # hash rook movement kingside
-            if white_move:
-                rook_origin = chess.H1
-                rook_destination = chess.F1
-            else:
-                rook_origin = chess.H8
-                rook_destination = chess.F8
-        else:
-            # hash rook movement queenside
-            if white_move:
-                rook_origin = chess.A1
-                rook_destination = chess.D1
-            else:
-                rook_origin = chess.A8
-                rook_destination = chess.D8
-        
-        rook = board.piece_at(rook_origin)
-
-        rook_origin_hash = get_piece_hash(rook, rook_origin)
-        rook_destination_hash = get_piece_hash(rook, rook_destination)
-
-        hash = np.bitwise_xor(hash, rook_origin_hash)
-        hash = np.bitwise_xor(hash, rook_destination_hash)
-    
-    elif move.promotion != None:
-        promoted_piece = chess.Piece(move.promotion, piece.color)
-        promoted_hash = get_piece_hash(promoted_piece, destination)
-        pawn_hash = get_piece_hash(piece, destination)
-
-        hash = np.bitwise_xor(hash, promoted_hash)
-        # special hash, adds pawn at destination location but it is removed by
-        # hashing with destination_hash later
-        hash = np.bitwise_xor(hash, pawn_hash)
-
-    # remove castling rights
-    if piece.piece_type == chess.KING:
-        if white_move:
-            hash = np.bitwise_xor(hash, white_castle[0])
-            hash = np.bitwise_xor(hash, white_castle[1])
-        else:
-            hash = np.bitwise_xor(hash, black_castle[0])
-            hash = np.bitwise_xor(hash, black_castle[1])
-    elif piece.piece_type == chess.ROOK:
-        if origin == chess.A1:
-            hash = np.bitwise_xor(hash, white_castle[0])
-        elif origin == chess.H1:
-            hash = np.bitwise_xor(hash, white_castle[1])
-        elif origin == chess.A8:
-            hash = np.bitwise_xor(hash, black_castle[0])
-        elif origin == chess.H8:
-            hash = np.bitwise_xor(hash, black_castle[1])
-    
-    # update en passant squares
-    if board.ep_square is not None:
-        old_file = chess.square_file(board.ep_square)
-        hash = np.bitwise_xor(hash, en_passant[old_file])
-    
-    if piece.piece_type == chess.PAWN and abs(destination - origin) == 16:
-        # double pawn push -> en passant square is behind the pawn
-        new_ep_file = chess.square_file(destination)
-        hash = np.bitwise_xor(hash, en_passant[new_ep_file])
+def get_board_hash(board):
+    hash = 0
+
+    if board.turn == chess.WHITE:
+        hash ^= TURN_KEY
 
+    for square in chess.scan_forward(board.clean_castling_rights() & chess.BB_CORNERS):
+        hash ^= CASTLING_KEYS[square]
 
-    hash = np.bitwise_xor(hash, origin_hash)
-    hash = np.bitwise_xor(hash, destination_hash)
+    for color in chess.COLORS:
+        for square in chess.scan_forward(board.occupied_co[color]):
+            hash ^= PIECE_KEYS[piece_index(color, board.piece_type_at(square)) * NUM_SQUARES + square]
 
-    hash = np.bitwise_xor(hash, black_turn)
+    # en passant only counts when a capture is actually possible
+    if board.ep_square is not None and _ep_capturable(board, board.ep_square, board.turn):
+        hash ^= EN_PASSANT_KEYS[chess.square_file(board.ep_square)]
 
     return hash
 
-def get_piece_hash(piece, square_index):
-    if piece == None:
-        return None
 
-    type = piece.piece_type
+def get_pawn_hash(board):
+    # zobrist key of the pawns alone, the pawn table key. The search keeps
+    # it up to date move by move with the evaluation terms, see
+    # evaluation.update_terms.
+    hash = 0
+    for color in chess.COLORS:
+        for square in chess.scan_forward(board.pawns & board.occupied_co[color]):
+            hash ^= PIECE_KEYS[int(color) * NUM_SQUARES + square]
+    return hash
+
+
+def process_move(hash, board, move):
+    # hash of the position after move, must be called before board.push(move)
+    origin = move.from_square
+    destination = move.to_square
+    color = board.turn
+    piece_type = board.piece_type_at(origin)
+    offset = int(color)
 
-    if piece.color == chess.WHITE:
-        # print()
-        return white_pieces[(type - 1) * NUM_SQUARES + square_index]
+    # single combined delta, xored into hash once at the end
+    delta = TURN_KEY ^ PIECE_KEYS[((piece_type - 1) * 2 + offset) * NUM_SQUARES + origin]
+
+    if board.is_castling(move):
+        if chess.square_file(destination) > chess.square_file(origin):
+            rook_origin, rook_destination = (chess.H1, chess.F1) if color else (chess.H8, chess.F8)
+            king_destination = chess.G1 if color else chess.G8
+        else:
+            rook_origin, rook_destination = (chess.A1, chess.D1) if color else (chess.A8, chess.D8)
+            king_destination = chess.C1 if color else chess.C8
+        rook_index = ((chess.ROOK - 1) * 2 + offset) * NUM_SQUARES
+        delta ^= PIECE_KEYS[((chess.KING - 1) * 2 + offset) * NUM_SQUARES + king_destination]
+        delta ^= PIECE_KEYS[rook_index + rook_origin] ^ PIECE_KEYS[rook_index + rook_destination]
     else:
-        # print()
-        return black_pieces[(type - 1) * NUM_SQUARES + square_index]
-
-
-################################################################################
-# TESTING
-################################################################################
-
-# board = chess.Board()
-
-# hash = compute_board_hash(board)
-# print(hash)
-# print()
-
-# move = chess.Move.from_uci("e2e4")
-# hash = process_move(hash, board, move)
-# board.push(move)
-# print("predicted hash", hash)
-# print("true hash", compute_board_hash(board))
-# print()
-
-# move = chess.Move.from_uci("d7d5")
-# hash = process_move(hash, board, move)
-# board.push(move)
-# print("predicted hash", hash)
-# print("true hash", compute_board_hash(board))
-# print()
-
-# move = chess.Move.from_uci("e4d5")
-# hash = process_move(hash, board, move)
-# board.push(move)
-# print("predicted hash", hash)
-# print("true hash", compute_board_hash(board))
-# print()
-
-# move = chess.Move.from_uci("e7e5")
-# board.push(move)
-# print(compute_board_hash(board))
-
-# for i in range(8):
-#     for j in range(8):
-#         # board.piece_at
-#         square = chess.square(j, i)
-
-#         piece = board.piece_at(square)
-#         if piece == None:
-#             continue
-
-#         square_index = chess.parse_square(chess.square_name(square))
-
-#         print(square, piece, compute_piece_index(piece, square_index))
-#         # print("hello")
\ No newline at end of file
+        # capture, including capture-promotions
+        captured = board.piece_type_at(destination)
+        if captured:
+            delta ^= PIECE_KEYS[((captured - 1) * 2 + 1 - offset) * NUM_SQUARES + destination]
+        elif piece_type == chess.PAWN and destination == board.ep_square:
+            captured_square = destination - 8 if color else destination + 8
+            delta ^= PIECE_KEYS[(1 - offset) * NUM_SQUARES + captured_square]
+
+        placed = move.promotion or piece_type
+        delta ^= PIECE_KEYS[((placed - 1) * 2 + offset) * NUM_SQUARES + destination]
+
+    # castling rights lost by moving the king or a rook, or by having a rook
+    # captured on its home square
+    rights = board.castling_rights
+    if rights:
+        touched = chess.BB_SQUARES[origin] | chess.BB_SQUARES[destination]
+        if piece_type == chess.KING:
+            touched |= _BACK_RANK[color]
+        if rights & touched:
+            for square in chess.scan_forward(board.clean_castling_rights() & touched & chess.BB_CORNERS):
+                delta ^= CASTLING_KEYS[square]
+
+    # update en passant squares
+    if board.ep_square is not None and _ep_capturable(board, board.ep_square, color):
+        delta ^= EN_PASSANT_KEYS[chess.square_file(board.ep_square)]
+
+    if piece_type == chess.PAWN and abs(destination - origin) == 16:
+        # double pawn push -> en passant square is behind the pawn
+        ep_square = (origin + destination) // 2
+        if _ep_capturable(board, ep_square, not color):
+            delta ^= EN_PASSANT_KEYS[chess.square_file(ep_square)]
+
+    return hash ^ delta
+
+
+def process_null_move(hash, board):
+    # hash after passing the turn, must be called before board.push(chess.Move.null())
+    if board.ep_square is not None and _ep_capturable(board, board.ep_square, board.turn):
+        hash ^= EN_PASSANT_KEYS[chess.square_file(board.ep_square)]
+    return hash ^ TURN_KEY
+
+
+def self_check(games=200, plies=120, seed=718):
+    # Plays random games and compares the incremental hash against a
+    # from-scratch hash and the polyglot reference after every move.
+    # Returns the number of positions checked, raises AssertionError on a
+    # mismatch.
+    rng = random.Random(seed)
+    checked = 0
+    for _ in range(games):
+        board = chess.Board()
+        hash = get_board_hash(board)
+        for _ in range(plies):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            # favour captures and promotions so the edge cases show up often
+            noisy = [m for m in moves if m.promotion or board.is_capture(m)]
+            move = rng.choice(noisy if noisy and rng.random() < 0.5 else moves)
+            hash = process_move(hash, board, move)
+            board.push(move)
+            expected = get_board_hash(board)
+            assert hash == expected, f"incremental {hash:#x} != scratch {expected:#x} after {move} in {board.fen()}"
+            assert expected == chess.polyglot.zobrist_hash(board), f"scratch hash differs from polyglot in {board.fen()}"
+            checked += 1
+    return checked